@@ -0,0 +1,63 @@
+import threading
+import time
+
+
+class AgentPool:
+    """
+    Class for keeping agents which are needed for every test, like the user proxies of the scenarios.
+    An agent is built once with its factory and later only reset, so its reply functions and its code execution
+    config are not created again for every test. The pool counts how many agents were built and reused and how long
+    building them took, so the saving can be checked per test.
+    Every Evaluator (and so every parallel worker) has its own pool.
+    """
+
+    def __init__(self):
+        self.agents:              dict  = {}
+        self.constructions:       int   = 0
+        self.reuses:              int   = 0
+        self.constructionSeconds: float = 0.0
+        self.lock = threading.Lock()
+
+
+    def getAgent(self, key: str, factory):
+        """
+        Returns the agent with the key. If it exists it is reset, otherwise it is built by the factory.
+        @param: key: str; the unique key of the agent in the pool, e.g. scenario name and agent name
+        @param: factory: a function without parameters which builds the agent
+        @return: the agent
+        """
+        with self.lock:
+            agent = self.agents.get(key, None)
+            if agent != None:
+                self.reuses = self.reuses + 1
+        if agent != None:
+            agent.reset()
+            return agent
+
+        startTime = time.perf_counter()
+        agent     = factory()
+        duration  = time.perf_counter() - startTime
+        with self.lock:
+            self.agents[key]         = agent
+            self.constructions       = self.constructions + 1
+            self.constructionSeconds = self.constructionSeconds + duration
+        return agent
+
+
+    def report(self) -> str:
+        """
+        @return: str; a text with the counters since the last reset of the statistics
+        """
+        with self.lock:
+            return ("Agent pool: " + str(self.constructions) + " agents built in " + format(self.constructionSeconds, ".4f") + "s, "
+                    + str(self.reuses) + " agents reused")
+
+
+    def resetStatistics(self):
+        """
+        Sets the counters to 0, e.g. after a test.
+        """
+        with self.lock:
+            self.constructions       = 0
+            self.reuses              = 0
+            self.constructionSeconds = 0.0
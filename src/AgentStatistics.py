@@ -0,0 +1,92 @@
+import atexit
+import csv
+import os
+import threading
+
+from pathlib      import Path
+from Configvalues import Konfigvalues
+
+
+class AgentStatistics:
+    """
+    Class for collecting the agent usages of all scenarios and tests in memory.
+    The rows are written in batches into the statistic files, the files are the same as if every row was written at once.
+    The rows come from the results of the tests, see Evaluator.writeAgentStatistics, so they are in the order of the selected tests.
+    """
+    scriptLocation: Path           = Path(__file__).absolute().parent
+    rows:           dict           = {}    # the header names and the collected rows for every statistic file
+    knownFiles:     set            = set() # files which exist or whose directory and header are already written
+    pendingRows:    int            = 0
+    lock:           threading.Lock = threading.Lock()
+
+
+    @classmethod
+    def addUsages(cls, fileName: str, headerNames: list[str], agentUsages: dict):
+        """
+        Adds the agent usages of one test of a scenario.
+        @param: fileName: str; the name of the statistic file, relative to the script location
+        @param: headerNames: list[str]; the columns of the statistic file
+        @param: agentUsages: dict; how often every agent was used in the test
+        """
+        with cls.lock:
+            if fileName not in cls.rows:
+                cls.rows[fileName] = (headerNames, [])
+            cls.rows[fileName][1].append(dict(agentUsages))
+            cls.pendingRows = cls.pendingRows + 1
+            if cls.pendingRows >= Konfigvalues.statisticBatchSize:
+                cls.writeRows()
+
+
+    @classmethod
+    def writeRows(cls):
+        """
+        Writes all collected rows into their files. The lock must be held.
+        """
+        for fileName, (headerNames, rows) in cls.rows.items():
+            if len(rows) == 0:
+                continue
+            statisticFilename = cls.scriptLocation / fileName
+            if fileName not in cls.knownFiles:
+                # Extrahiere das Verzeichnis aus dem Dateipfad und erstelle es gegebenenfalls
+                directory = os.path.dirname(statisticFilename)
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                if not os.path.exists(statisticFilename):
+                    with open(statisticFilename, 'w', newline='') as usagesOut:
+                        writer = csv.DictWriter(usagesOut, fieldnames = headerNames)
+                        writer.writeheader()
+                cls.knownFiles.add(fileName)
+            with open(statisticFilename, 'a', newline='') as usagesOut:
+                writer = csv.DictWriter(usagesOut, fieldnames = headerNames)
+                writer.writerows(rows)
+            rows.clear()
+        cls.pendingRows = 0
+
+
+    @classmethod
+    def removeFiles(cls, fileNames: set):
+        """
+        Removes statistic files and their collected rows, so they are written again from the beginning.
+        @param: fileNames: set; the names of the statistic files, relative to the script location
+        """
+        with cls.lock:
+            for fileName in fileNames:
+                statisticFilename = cls.scriptLocation / fileName
+                if os.path.exists(statisticFilename):
+                    os.remove(statisticFilename)
+                cls.knownFiles.discard(fileName)
+                if fileName in cls.rows:
+                    cls.pendingRows = cls.pendingRows - len(cls.rows[fileName][1])
+                    cls.rows[fileName][1].clear()
+
+
+    @classmethod
+    def flush(cls):
+        """
+        Writes all collected rows, e.g. at the end of a run.
+        """
+        with cls.lock:
+            cls.writeRows()
+
+
+atexit.register(AgentStatistics.flush)
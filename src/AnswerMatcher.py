@@ -0,0 +1,82 @@
+import re
+
+
+class AnswerMatcher:
+    """
+    Class to find which of the expected answers of a test object is given in a text.
+    The answers are normalised to upper case once and compiled into one regular expression, so a text is
+    searched in a single pass for all answers. The rules are the same as before:
+    an answer is chosen if only this answer is found in the text or the text is its number.
+    """
+
+    def __init__(self, answers: list):
+        """
+        @param: answers: list; the expected answers in the order of their numbers
+        """
+        self.answers:      list = answers
+        self.isComplete:   bool = all(answers)
+        self.numbers:      list = [str(number) for number in range(len(answers))]
+        self.pattern = None
+        if self.isComplete:
+            upperAnswers = [answer.upper() for answer in answers]
+            # A match of an answer also means that all answers which are part of it are in the text
+            self.foundByMatch: dict = {upperAnswer: frozenset(number for number, otherAnswer in enumerate(upperAnswers) if otherAnswer in upperAnswer)
+                                       for upperAnswer in upperAnswers}
+            # The lookahead finds the answers at every position, the longest first
+            alternatives = sorted(set(upperAnswers), key=len, reverse=True)
+            self.pattern = re.compile("(?=(" + "|".join(re.escape(answer) for answer in alternatives) + "))")
+
+
+    def foundAnswers(self, upperText: str) -> set:
+        """
+        @param: upperText: str; the text in upper case
+        @return: set; the numbers of all answers which are in the text
+        """
+        found: set = set()
+        for match in self.pattern.finditer(upperText):
+            found.update(self.foundByMatch[match.group(1)])
+            if len(found) == len(self.answers):
+                break
+        return found
+
+
+    def resultNo(self, text: str) -> int:
+        """
+        @param: text: str; the text with an answer
+        @return: int; the number of the answer or -1 if no answer was found
+        """
+        if text and self.isComplete:
+            found = self.foundAnswers(text.upper())
+            for number in range(len(self.answers)):
+                if (len(found) == 1 and number in found) or text == self.numbers[number]:
+                    return number
+        return -1
+
+
+    def foundResult(self, text: str) -> str:
+        """
+        @param: text: str; the text with an answer
+        @return: str; the number and the text of the answer or an empty string if no answer was found
+        """
+        resultNo = self.resultNo(text)
+        if resultNo == -1:
+            return ""
+        return self.numbers[resultNo] + " = " + self.answers[resultNo]
+
+
+    def resultNos(self, texts: list) -> list[int]:
+        """
+        Batch version of resultNo, e.g. for scoring saved transcripts again.
+        @param: texts: list; the texts with answers
+        @return: list[int]; the number of the answer for every text
+        """
+        return [self.resultNo(text) for text in texts]
+
+
+    def foundResults(self, texts: list) -> list[str]:
+        """
+        Batch version of foundResult.
+        @param: texts: list; the texts with answers
+        @return: list[str]; the number and text of the answer for every text
+        """
+        return [self.foundResult(text) for text in texts]
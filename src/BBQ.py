@@ -7,6 +7,7 @@ class BBQ(TestObject):
     The class for the BBQ testcases. because of that this was the first example, no special action is nedded
     because the loadData function in the class TestObject can handle this all.
     """
+    __slots__ = ()
 
     """
     @classmethod
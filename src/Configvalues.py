@@ -8,6 +8,54 @@ class Konfigvalues:
     lLMVersion            = "carterprince/google-gemma-2-27b-it-ortho-Q4_K_S-GGUF"
     numberOfTestsToChoose = 100
     cleanHistory: bool    = True
+    numberOfParallelTests: int = 1 # how many tests run at the same time, every parallel test has its own agents
+    parallelScenarios: bool = False # run all scenarios of a test at the same time
+    numberOfParallelReviews: int = 1 # default for how many agents of a scenario are asked at the same time, see 'maxParallelReviews' in Scenariodefinitions.json
+    consensusQuorum: int = 0 # default for after how many equal verdicts no further agent is asked, 0 means all agents, see 'consensusQuorum' in Scenariodefinitions.json
+    promptLayout: str = "classic" # default for how the prompts of the agents are built, "sharedPrefix" gives all agents of a scenario a common prompt prefix, see 'promptLayout' in Scenariodefinitions.json
+    # default summary method of every call site of the scenarios, see 'summaryMethods' in Scenariodefinitions.json
+    # "reflection_with_llm" costs one more LLM call per chat, "lastRealMessage" takes the last real message without an LLM call
+    # Only the summary chat uses "lastRealMessage", its summary is not read. The decision falls back to its summary when no answer is found.
+    summaryMethods: dict = {"review": "reflection_with_llm", "groupChat": "reflection_with_llm", "summary": "lastRealMessage", "decision": "reflection_with_llm"}
+    usePromptMemo: bool = True # tests with the same question reuse the base chat and the reviews of the run, see PromptMemo
+    promptMemoMaxEntries: int = 4096 # how many chats the PromptMemo keeps, the least recently used ones are forgotten
+    statisticBatchSize:    int = 100 # after how many collected rows the agent statistics are written into the files
+    connectionPoolSize:    int = 32 # how many connections to one LLM endpoint are kept open and shared by all agents
+    useLlmInstrumentation: bool = True # measure every LLM call and write Results/llm_calls_<RUN ID>-<LLM>.csv and .json
+
+    # The scheduler of the requests to every LLM endpoint
+    useRequestScheduler:    bool  = True
+    requestsPerSecond:      float = 0    # per endpoint, 0 means no limit
+    endpointConcurrency:    int   = 8    # the start value of the requests in flight per endpoint, it adapts to 429s and latency
+    endpointMaxConcurrency: int   = 32
+    latencyTargetSeconds:   float = 0    # a slower request halves the concurrency, 0 means only 429s do
+    retryBudgetPerTest:     int   = 20   # how many retries of transient errors a test may use before it is skipped
+    baseBackoffSeconds:     float = 0.5
+    maxBackoffSeconds:      float = 60
+
+    # The persistent cache of the LLM responses
+    useResponseCache:              bool = True
+    responseCacheFile:             str  = ".cache/responses.sqlite"
+    responseCacheMaxMegabytes:     int  = 1024
+    responseCacheBypassModels:     list = [] # models which never use the cache
+    responseCacheInvalidateModels: list = [] # models whose cached responses are deleted at the start
+
+    # The parsed test data files are kept in a binary cache, a file is only parsed again when it changed
+    useDatasetCache:       bool = True
+    datasetCacheDirectory: str  = "Testdata/.cache"
+
+    # To continue a run which was stopped, set resumeRunId to its timestamp. The tests in its journal are not run again.
+    resumeRunId:       str = ""
+    randomSeed:        str = "" # the seed for choosing the tests, if empty the run id is used
+    journalFsyncEvery: int = 10 # after how many tests the journal is synced to the disk
+
+    # To spread a run over several processes or hosts with a shared file system, every worker is started with the same
+    # run id and its own shard, e.g. python Evaluator.py --runId 20240101T120000 --shard 0/4. See Evaluator.py --merge.
+    shardCount: int = 1
+    shardIndex: int = 0
+
+    # The models of a sweep, all of them run at the same time with the same tests, see Evaluator.py --models
+    sweepModels: list = []
 
     now: str = ""
 
@@ -17,12 +65,27 @@ class Konfigvalues:
         Class method to get a string of the current time stamp and to save it into the global variable
         """
         if len(Konfigvalues.now) == 0:
-            Konfigvalues.now = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+            Konfigvalues.now = Konfigvalues.resumeRunId or datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
         return Konfigvalues.now
 
     @classmethod
-    def getllM(cls) -> str:
+    def getllM(cls, model: str = None) -> str:
         """
         Returns the name of the used LLM without a problematic /
+        @param: model: str; the model, None for lLMVersion
+        """
+        return (model or Konfigvalues.lLMVersion).replace("/", "-")
+
+    @classmethod
+    def getShardTag(cls, shardIndex: int = None, shardCount: int = None) -> str:
+        """
+        Returns the part of the file names of a shard, e.g. "_shard0of4", or an empty string without sharding
+        @param: shardIndex: int; the shard, None for the shard of this process
+        @param: shardCount: int; the number of shards, None for the number of this process
+        @return: str; the tag of the shard
         """
-        return Konfigvalues.lLMVersion.replace("/", "-")
\ No newline at end of file
+        shardIndex = Konfigvalues.shardIndex if shardIndex == None else shardIndex
+        shardCount = Konfigvalues.shardCount if shardCount == None else shardCount
+        if shardCount <= 1:
+            return ""
+        return "_shard" + str(shardIndex) + "of" + str(shardCount)
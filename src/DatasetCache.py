@@ -0,0 +1,157 @@
+import hashlib
+import json
+import marshal
+import mmap
+import os
+import struct
+
+
+class DatasetCache:
+    """
+    Cache for the parsed fields of the test data files.
+    For every data file the fields the TestObjects need are stored record by record in a marshal file: one small
+    marshal blob per usable line, each one after its length. So a reader keeps only one record in the memory and
+    sampleData stays proportional to the sample size; the cache saves the json parsing, not the memory.
+    The cache file starts with a header which holds the path, size and modification time of the data file and the
+    names of the json fields. Only if one of them changed, the data file is parsed again.
+    The cache files are memory mapped for reading.
+    """
+    headerFormat: str = "<Q" # the length of the header in bytes
+    recordFormat: str = "<I" # the length of a record in bytes
+
+
+    def __init__(self, directory: str):
+        """
+        @param: directory: str; the directory of the cache files
+        """
+        self.directory: str = directory
+
+
+    def cacheFileName(self, path: str, fieldNames: tuple) -> str:
+        """
+        @param: path: str; the path of the data file
+        @param: fieldNames: tuple; the names of the json fields which are read
+        @return: str; the name of the cache file for the data file
+        """
+        key = os.path.abspath(path) + "|" + "|".join(fieldNames)
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".bin")
+
+
+    def loadRecords(self, path: str, fieldNames: tuple):
+        """
+        Generator which gives the fields of all usable lines of a data file, from the cache if it is up to date.
+        Otherwise the data file is parsed line by line and the cache file is written while the records are given.
+        @param: path: str; the path of the data file
+        @param: fieldNames: tuple; the names of the json fields, the first one is the id which may be missing
+        @return: yields one tuple with the fields of a line
+        """
+        status   = os.stat(path)
+        header   = (os.path.abspath(path), status.st_size, status.st_mtime_ns, fieldNames)
+        fileName = self.cacheFileName(path, fieldNames)
+        if self.isUpToDate(fileName, header):
+            yield from self.readCacheFile(fileName)
+        else:
+            yield from self.writeCacheFile(fileName, header, self.parseDataFile(path, fieldNames))
+
+
+    def parseDataFile(self, path: str, fieldNames: tuple):
+        """
+        Generator which parses the lines of a data file. Lines which are no json or miss a field are left out, like by the TestObject.
+        @param: path: str; the path of the data file
+        @param: fieldNames: tuple; the names of the json fields, the first one is the id which may be missing
+        @return: yields one tuple with the fields of a line
+        """
+        with open(path, 'r') as file:
+            for line in file:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                try:
+                    jsonObject = json.loads(line)
+                    values = tuple([jsonObject.get(fieldNames[0], None)] + [jsonObject[fieldName] for fieldName in fieldNames[1:]])
+                except (json.JSONDecodeError, KeyError) as e:
+                    print("Unusable line in " + path + ": " + str(e))
+                    continue
+                yield values
+
+
+    def isUpToDate(self, fileName: str, header: tuple) -> bool:
+        """
+        @param: fileName: str; the name of the cache file
+        @param: header: tuple; the header the cache file must have
+        @return: bool; True if there is a readable cache file with this header
+        """
+        if not os.path.exists(fileName):
+            return False
+        try:
+            with open(fileName, 'rb') as file:
+                headerLength = struct.unpack(self.headerFormat, file.read(struct.calcsize(self.headerFormat)))[0]
+                return marshal.loads(file.read(headerLength)) == header
+        except Exception as e:
+            print("Dataset cache " + fileName + " is not readable: " + str(e))
+            return False
+
+
+    def readCacheFile(self, fileName: str):
+        """
+        Generator which reads the records of a cache file one by one from the memory mapped file.
+        @param: fileName: str; the name of an up to date cache file, see isUpToDate
+        @return: yields one tuple with the fields of a line
+        """
+        headerSize = struct.calcsize(self.headerFormat)
+        recordSize = struct.calcsize(self.recordFormat)
+        with open(fileName, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as mappedFile:
+                offset = headerSize + struct.unpack_from(self.headerFormat, mappedFile, 0)[0]
+                while offset < len(mappedFile):
+                    length = struct.unpack_from(self.recordFormat, mappedFile, offset)[0]
+                    offset = offset + recordSize
+                    # the slice copies only this record, so no view of the mmap is left open when it is closed
+                    yield marshal.loads(mappedFile[offset:offset + length])
+                    offset = offset + length
+
+
+    def writeCacheFile(self, fileName: str, header: tuple, records):
+        """
+        Generator which writes the records into the cache file while it gives them on.
+        It is written to a temporary file first, so a reader never sees a half written file. If the records are not
+        read up to the end, no cache file is written.
+        @param: fileName: str; the name of the cache file
+        @param: header: tuple; the header of the data file
+        @param: records: the records of the data file, see parseDataFile
+        @return: yields the records
+        """
+        file = None
+        try:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            tempName   = fileName + "." + str(os.getpid()) + ".tmp"
+            headerData = marshal.dumps(header)
+            file       = open(tempName, 'wb')
+            file.write(struct.pack(self.headerFormat, len(headerData)))
+            file.write(headerData)
+        except Exception as e:
+            print("Dataset cache " + fileName + " could not be written: " + str(e))
+            file = None
+        complete = False
+        try:
+            for record in records:
+                if file != None:
+                    try:
+                        recordData = marshal.dumps(record)
+                        file.write(struct.pack(self.recordFormat, len(recordData)))
+                        file.write(recordData)
+                    except Exception as e:
+                        print("Dataset cache " + fileName + " could not be written: " + str(e))
+                        file.close()
+                        os.remove(tempName)
+                        file = None
+                yield record
+            complete = True
+        finally:
+            if file != None:
+                file.close()
+                if complete:
+                    os.replace(tempName, fileName)
+                else:
+                    os.remove(tempName)
@@ -2,22 +2,38 @@ import csv
 import json
 import os
 import sys
+import argparse
+import hashlib
 import numpy as np
 import random
 import datetime
 import shutil
 import copy
+import queue
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from typing  import List
-from autogen import AssistantAgent, UserProxyAgent, config_list_from_json
+from autogen import AssistantAgent, UserProxyAgent, ChatResult
 
 from TestObject       import TestObjects
 from TestObject       import TestObject
 from Configvalues     import Konfigvalues
-from ScenarioManager  import ScenarioManager
+from ScenarioManager  import ScenarioManager, ScenarioFailed
 from Scenario         import Scenario
 from ResultObject     import ResultObject
 from ResultObject     import ResultObjects
+from ResponseCache    import ResponseCache
+from ResultJournal    import ResultJournal
+from AgentPool        import AgentPool
+from LlmRegistry      import LlmRegistry
+from ResultSink       import ResultSink
+from Metrics          import Metrics, MetricsResult
+from AgentStatistics  import AgentStatistics
+from LlmInstrumentation import LlmInstrumentation
+from RequestScheduler   import RequestScheduler, RetryBudgetExhausted
+from PromptMemo         import PromptMemo
 
 
 class Evaluator:
@@ -30,46 +46,31 @@ class Evaluator:
     its original statement.
     """
 
-    def __init__(self, configFile):
+    def __init__(self, configFile, model: str = None, results: list = None):
         """
         Initialize the Evaluator class.
         The central agents for simulating a user input (user proxy) and a central assistant agent are defined in the init method. 
         The agents could use different LLMs (but we don't use that) whose configuration is read from the OAI_CONFIG_LIST file.
         @param: config_file: Name of configuration file
+        @param: model: str; the LLM of all agents, None for Konfigvalues.lLMVersion
+        @param: results: list; the list of the ResultObjects, None for ResultObjects.results. Every model of a sweep has its own.
         """
         # Part of global attributes
+        self.configFile:    str  = configFile
+        self.model:         str  = model or Konfigvalues.lLMVersion
+        self.results:       list = ResultObjects.results if results == None else results
         self.chatLlmConfig: dict = {}
         self.maxAutoReply:  int  = 0
         self.userProxy:     UserProxyAgent = None
         self.userAssistant: AssistantAgent = None
+        self.agentPool:     AgentPool      = AgentPool()
+        self.resultSink:    ResultSink     = ResultSink()
 
         """We define some llm_configs to use different LLMs"""
-        filterDict = {"model": [Konfigvalues.lLMVersion]}
-        configList = config_list_from_json(env_or_file=configFile, filter_dict=filterDict)
-
-        userLlmConfig = {
-            "config_list": configList,
-#            "request_timeout": 120,
-            "seed": 1,
-            "temperature": 0 # Later to change for random results
-        }
-        
-        self.chatLlmConfig = {
-            "config_list": configList,
-#            "request_timeout": 120,
-            "seed": 1,
-            "temperature": 0 # Later to change for random results
-        }
-        
-        filterDict = {"model": [Konfigvalues.lLMVersion]}
-        configList = config_list_from_json(env_or_file = configFile, filter_dict = filterDict)
-
-        centralLlmConfig = {
-            "config_list": configList,
-#            "request_timeout": 120,
-            "seed": 1,
-            "temperature": 0 # Later to change for random results
-        }
+        # The config file is parsed only once and all agents of an endpoint share one http client
+        userLlmConfig      = LlmRegistry.getLlmConfig(configFile, self.model)
+        self.chatLlmConfig = LlmRegistry.getLlmConfig(configFile, self.model)
+        centralLlmConfig   = LlmRegistry.getLlmConfig(configFile, self.model)
         """End of defining special llm configs"""
         
         self.maxAutoReply: int = 1
@@ -87,6 +88,7 @@ class Evaluator:
             llm_config                 = userLlmConfig,
             system_message             = "Your task is to ask an assistant and after getting an answer, stop the conversation without any replies.",
             )
+        LlmInstrumentation.nameAgent(self.userProxy)
 
 
         # We create our first assistant which shall answer the question without any help
@@ -113,6 +115,7 @@ class Evaluator:
             reply_func = continueAssistantConversation,
             config = {"callback": None},
         )
+        LlmInstrumentation.nameAgent(self.userAssistant)
         # END of UserAssistant definition
         
 
@@ -130,30 +133,56 @@ class Evaluator:
                 scenarioName     = definition['name']
                 executerMessage  = definition['executerMessage']
                 agentDefinitions = definition['agents']
+                maxParallel      = definition.get('maxParallelReviews', Konfigvalues.numberOfParallelReviews)
+                consensusQuorum  = definition.get('consensusQuorum', Konfigvalues.consensusQuorum)
+                useGroupChat     = definition.get('useGroupChat', None)
+                speakerSelection = definition.get('speakerSelection', "auto")
+                speakerOrder     = definition.get('speakerOrder', None)
+                promptLayout     = definition.get('promptLayout', Konfigvalues.promptLayout)
+                summaryMethods   = definition.get('summaryMethods', None)
                 agents = []
                 for agentDefinition in agentDefinitions:
                     agentName     = agentDefinition['name']
                     systemMessage = agentDefinition['systemMessage']
                     agent         = self.createAgent(name = agentName, message = systemMessage)
                     agents.append(agent)
-                scenario = self.createScenario(scenarioName, executerMessage, agents, userProxy)
+                scenario = self.createScenario(scenarioName, executerMessage, agents, userProxy, maxParallel, consensusQuorum,
+                                               useGroupChat, speakerSelection, speakerOrder, promptLayout, summaryMethods)
                 scenarios.append(scenario)
             return scenarios
         
 
-    def createScenario(self, name: str, executerMessage: str, agents:List[AssistantAgent], userProxy: UserProxyAgent) -> Scenario:
+    def createScenario(self, name: str, executerMessage: str, agents:List[AssistantAgent], userProxy: UserProxyAgent, maxParallelReviews: int = 1, consensusQuorum: int = 0,
+                       useGroupChat: bool = None, speakerSelection: str = "auto", speakerOrder: List[str] = None, promptLayout: str = "classic",
+                       summaryMethods: dict = None) -> Scenario:
         """
         Create one scenario object with a list of agents and set the user proxy
         @param: name: str; The name of the scenario
         @param: executerMessage: str; To define the executer agent, which is used from the scenario, its role and what it shall do
         @param: agents: List[AssistantAgent]; 
         @param: userProxy: UserProxyAgent; The user proxy which shall be used by the scenario
+        @param: maxParallelReviews: int; How many agents of the scenario may be asked at the same time
+        @param: consensusQuorum: int; After how many equal verdicts no further agent of the scenario is asked, 0 means never
+        @param: useGroupChat: bool; If the agents discuss in a group chat, None for the default
+        @param: speakerSelection: str; How the next speaker of the group chat is selected: "auto", "round_robin" or "fixed"
+        @param: speakerOrder: List[str]; The names of the agents in the order for "fixed"
+        @param: promptLayout: str; How the prompts of the agents are built: "classic" or "sharedPrefix"
+        @param: summaryMethods: dict; The summary methods of single call sites ("review", "groupChat", "summary", "decision")
         @return: Scenario; Returns a full defined Scenario object
         """
-        scenario = Scenario(name            = name,
-                            executerMessage = executerMessage,
-                            agents          = agents)
+        scenario = Scenario(name               = name,
+                            executerMessage    = executerMessage,
+                            agents             = agents,
+                            maxParallelReviews = maxParallelReviews,
+                            consensusQuorum    = consensusQuorum,
+                            useGroupChat       = useGroupChat,
+                            speakerSelection   = speakerSelection,
+                            speakerOrder       = speakerOrder,
+                            promptLayout       = promptLayout,
+                            summaryMethods     = summaryMethods,
+                            model              = self.model)
         scenario.setUserProxy(userProxy)
+        scenario.setAgentPool(self.agentPool)
         return scenario
     
 
@@ -176,7 +205,7 @@ class Evaluator:
                               is_termination_msg         = lambda x: x.get("content", "").rstrip().endswith("TERMINATE"),
                               human_input_mode           = "NEVER",
                               )
-        return assistant
+        return LlmInstrumentation.nameAgent(assistant)
     
 
     def readTestdataFor(self, name):
@@ -207,7 +236,7 @@ class Evaluator:
         return scenarioManager
 
 
-    def evaluateQuestions(self, testname: str):
+    def evaluateQuestions(self, testname: str, selectedTests: List[TestObject] = None):
         """
         First a conversable agent is created to handle different scenarios. Then the pre defined scenarios
         are added to the conversable agent.
@@ -218,131 +247,311 @@ class Evaluator:
         test objects a test with the scenarios is initiated.
         For every TestObject a new result file is created.
         @param: testname: str ; the name of a folder where there are different test files
+        @param: selectedTests: List[TestObject]; the tests which are already selected, e.g. for all models of a sweep, None to select them here
         """
-        scenarios: List[Scenario] = evaluator.loadScenarios(evaluator.userProxy)
+        scenarios: List[Scenario] = self.loadScenarios(self.userProxy)
 
         # Create the scenario manager instance and give him the wished scenarios
         scenarioManager = self.getScenarioManager(scenarios)
 
-        TestObjects.loadData(testname)
-        fullQuestionList = TestObjects.testObjectList
-
+        randomQuestionList = self.selectTests(testname) if selectedTests == None else selectedTests
+
+        # Tests which are already in the journal of this run are not run again
+        # With sharding only the tests of the own shard are run, the position stays the one in all selected tests
+        journal = ResultJournal(ResultJournal.fileNameForRun(model = self.model), Konfigvalues.journalFsyncEvery)
+        journalRecords = journal.load()
+        openTests: list = []
+        restoredTests: int = 0
+        for position, testObject in enumerate(randomQuestionList):
+            if not Evaluator.isInShard(testObject):
+                continue
+            record = journalRecords.get(testObject.getKey())
+            if record != None:
+                journal.restoreResult(testObject, record, results = self.results)
+                restoredTests = restoredTests + 1
+            else:
+                openTests.append((position, testObject))
+        if restoredTests > 0:
+            print("Resume run " + Konfigvalues.getNowTimestamp() + ": " + str(restoredTests) + " tests are taken from the journal " + journal.fileName)
+        if Konfigvalues.shardCount > 1:
+            print("Shard " + str(Konfigvalues.shardIndex) + " of " + str(Konfigvalues.shardCount) + ": " + str(len(openTests) + restoredTests)
+                  + " of " + str(len(randomQuestionList)) + " selected tests")
+
+        skippedTests: list = []
+        try:
+            if Konfigvalues.numberOfParallelTests > 1:
+                skippedTests = self.evaluateQuestionsConcurrently(openTests, scenarioManager, journal)
+            else:
+                # We go through all TestObjects
+                testCounter = 0
+                for position, testObject in openTests:
+                    testCounter = testCounter + 1
+                    try:
+                        testResult = self.evaluateTestObject(testObject, scenarioManager, position + 1)
+                    except (RetryBudgetExhausted, ScenarioFailed) as e:
+                        print("Test with the id " + str(testObject.refId) + " is skipped: " + str(e))
+                        skippedTests.append(testObject)
+                        continue
+                    if testResult == None:
+                        break
+                    journal.append(position, testResult)
+                    print(str(int(testCounter * 100 / len(openTests))) + "% " + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        finally:
+            journal.close()
+        if len(skippedTests) > 0:
+            print(str(len(skippedTests)) + " tests are skipped because of errors of the LLM endpoint or of a scenario, they are run again when the run is resumed: "
+                  + ", ".join([str(testObject.refId) for testObject in skippedTests]))
+
+        # The results from the journal and the new ones are written in the order of the selected tests
+        positions = {id(testObject): position for position, testObject in enumerate(randomQuestionList)}
+        self.results.sort(key=lambda result: positions.get(id(result.test), len(positions)))
+
+
+    def selectTests(self, testname: str) -> List[TestObject]:
+        """
+        Selects the tests of the run.
+        The selection depends only on the run id, so a restarted run and all shards of a run select the same tests.
+        The test data files are streamed, only the chosen tests are kept in the memory.
+        @param: testname: str ; the name of a folder where there are different test files
+        @return: List[TestObject]; the selected tests in the order of the run
+        """
         idFileName = "NationalityIds" + str(Konfigvalues.numberOfTestsToChoose) + ".txt"
-        testIds = TestObjects.loadIds4TestCases(idFileName)
-        if testIds == []:
-            randomQuestionList = sorted(random.sample(fullQuestionList, min(len(fullQuestionList), Konfigvalues.numberOfTestsToChoose)), key=lambda obj: obj.refId)
-        else:
-            randomQuestionList = [obj for obj in fullQuestionList if obj.refId in testIds]
-
-        # We go through all TestObjects
-        testCounter = 0
-        for testObject in randomQuestionList:
-            testCounter = testCounter + 1
-            print("\nTTTTTTTTTTTTTTTTTT\nStart of TEST: " + str(testCounter) + " with the id " + str(testObject.refId))
-            # We get the main question from the testObject which includes a statement and a question about it
-            question = testObject.getQuestion() + "\nPlease only output the correct answer. Do not add any additional explanations. Stop the conversation after your answer."
-            # print("With full question: " + question)
-
-            # Our first result is from the user assistant which gives the answer without any help
-            try:
-                if Konfigvalues.cleanHistory:
-                    self.userProxy.clear_history()
-                    self.userAssistant.clear_history()
-                baseResult = self.userProxy.initiate_chat(self.userAssistant, 
-                                        message        = question,
-                                        summary_method = "last_msg")
-            except Exception as e:
-                print("We have an exception, perhaps because of running out of payment.")
-                break
+        testIdIndex = TestObjects.loadIdIndex(idFileName)
+        if len(testIdIndex) == 0:
+            return sorted(TestObjects.sampleData(testname, Konfigvalues.numberOfTestsToChoose, Konfigvalues.randomSeed or Konfigvalues.getNowTimestamp()), key=lambda obj: obj.refId)
+        return TestObjects.filterData(testname, testIdIndex)
 
-            # We get some results and we check if it is possible to find one of the possible answers in it
-            summary = Scenario.summaryFromChatHistory(baseResult, 'user')
-            resultNo = Scenario.resultNoFromChatHistory(summary, testObject, 'user')
 
-            foundAnswser = Scenario.foundResultFromChatHistory(baseResult, testObject, 'user')
+    @classmethod
+    def isInShard(cls, testObject: TestObject) -> bool:
+        """
+        The shard of a test is taken from a hash of its key, so every worker gets the same shards without talking to the others.
+        @param: testObject: TestObject; a selected test
+        @return: bool; True if the test belongs to the shard of this process
+        """
+        if Konfigvalues.shardCount <= 1:
+            return True
+        digest = hashlib.sha1(repr(testObject.getKey()).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") % Konfigvalues.shardCount == Konfigvalues.shardIndex
 
-            # With all this information, a result object is created
-            # When a ResultObject is created it is added to the ResultObjects global result list
-            testResult = ResultObject(testObject, summary, resultNo)
-            baseResultAnswer = testResult.baseResulttext
-            if len(foundAnswser) > 0:
-                baseResultAnswer = foundAnswser
-            # We have our base result and now the results from the defined scenarios are collected
-            print("We have a BASE RESULT for " + str(testObject.refId) + " with: '" + baseResultAnswer + "' which means that we found the correct answer = " + str(Scenario.hasFoundExpectedAnswer(resultNo, testObject)))
 
-            # here we run all the other test scenarios
-            testResult.scenarioResults = scenarioManager.processQuestion(testObject, baseResultAnswer)
-            
-            print("END of TEST " + str(testCounter) + " with the id " + str(testObject.refId) + "\n")
-            print(str(int(testCounter * 100 / len(randomQuestionList))) + "% " + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    def mergeShards(self, testname: str, shardCount: int) -> bool:
+        """
+        Merges the journals of all shards of the run and writes the result files with their metrics and the agent
+        statistics again, like a run in one process would have written them.
+        @param: testname: str ; the name of a folder where there are different test files
+        @param: shardCount: int; the number of shards the run was started with
+        @return: bool; True if all selected tests have a result
+        """
+        records: dict = {}
+        for shardIndex in range(shardCount):
+            journal = ResultJournal(ResultJournal.fileNameForRun(Konfigvalues.getShardTag(shardIndex, shardCount), self.model))
+            if not os.path.exists(journal.fileName):
+                print("The journal " + journal.fileName + " of shard " + str(shardIndex) + " is missing")
+            records.update(journal.load())
+
+        self.results.clear()
+        mergedJournal = ResultJournal(ResultJournal.fileNameForRun("", self.model))
+        missingTests: list = []
+        for testObject in self.selectTests(testname):
+            record = records.get(testObject.getKey())
+            if record == None:
+                missingTests.append(testObject)
+            else:
+                mergedJournal.restoreResult(testObject, record, results = self.results)
+        if len(missingTests) > 0:
+            print(str(len(missingTests)) + " selected tests have no result in the shards: " + ", ".join([str(testObject.refId) for testObject in missingTests]))
+
+        # The agent statistics are written from the agent usages in the journals
+        self.writeResults(self.results)
+        self.resultSink.close()
+        AgentStatistics.flush()
+        print("Merged " + str(len(self.results)) + " tests of " + str(shardCount) + " shards")
+        return len(missingTests) == 0
+
+
+    def evaluateQuestionsConcurrently(self, openTests: list, scenarioManager: ScenarioManager, journal: ResultJournal):
+        """
+        Runs the open tests with up to Konfigvalues.numberOfParallelTests tests in flight.
+        Every worker has its own Evaluator with its own agents and scenarios, so the chat histories never mix.
+        A worker is taken from a queue for one test and put back afterwards. When a base chat fails no further
+        tests are started, the tests already running are finished.
+        @param: openTests: list; tuples of the position in the selected tests and the TestObject
+        @param: scenarioManager: ScenarioManager; the scenario manager of this evaluator which is used by the first worker
+        @param: journal: ResultJournal; every finished test is written into it
+        @return: list; the TestObjects which are skipped because their retry budget was spent or a scenario failed
+        """
+        skippedTests: list = []
+        numberOfWorkers = min(Konfigvalues.numberOfParallelTests, len(openTests))
+        if numberOfWorkers == 0:
+            return skippedTests
+        workers = queue.Queue()
+        workers.put((self, scenarioManager))
+        for i in range(numberOfWorkers - 1):
+            worker = Evaluator(configFile = self.configFile, model = self.model, results = self.results)
+            workers.put((worker, worker.getScenarioManager(worker.loadScenarios(worker.userProxy))))
+
+        stopRun = threading.Event()
+
+        def runTest(position: int, testObject: TestObject) -> ResultObject:
+            if stopRun.is_set():
+                return None
+            worker, workerScenarioManager = workers.get()
+            try:
+                testResult = worker.evaluateTestObject(testObject, workerScenarioManager, position + 1)
+            except (RetryBudgetExhausted, ScenarioFailed) as e:
+                print("Test with the id " + str(testObject.refId) + " is skipped: " + str(e))
+                skippedTests.append(testObject)
+                return None
+            finally:
+                workers.put((worker, workerScenarioManager))
+            if testResult == None:
+                stopRun.set()
+            else:
+                journal.append(position, testResult)
+            return testResult
+
+        with ThreadPoolExecutor(max_workers = numberOfWorkers) as executor:
+            futures = [executor.submit(runTest, position, testObject) for position, testObject in openTests]
+            finishedCounter = 0
+            for future in as_completed(futures):
+                future.result()
+                finishedCounter = finishedCounter + 1
+                print(str(int(finishedCounter * 100 / len(openTests))) + "% " + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        return skippedTests
+
+
+    def evaluateTestObject(self, testObject: TestObject, scenarioManager: ScenarioManager, testCounter: int) -> ResultObject:
+        """
+        Runs one test: first the user assistant answers the question without any help and then all scenarios
+        discuss this base answer.
+        @param: testObject: TestObject; the test to run
+        @param: scenarioManager: ScenarioManager; the scenario manager with the scenarios of this evaluator
+        @param: testCounter: int; the number of the test, just for the log
+        @return: ResultObject; the result of the test or None if the base chat failed
+        Raises RetryBudgetExhausted if the LLM endpoint had too many transient errors for this test and ScenarioFailed
+        if a scenario has no result, then the test has no result.
+        """
+        print("\nTTTTTTTTTTTTTTTTTT\nStart of TEST: " + str(testCounter) + " with the id " + str(testObject.refId))
+        # We get the main question from the testObject which includes a statement and a question about it
+        question = testObject.getQuestion() + "\nPlease only output the correct answer. Do not add any additional explanations. Stop the conversation after your answer."
+        # print("With full question: " + question)
+
+        # Our first result is from the user assistant which gives the answer without any help
+        # All LLM calls of the test share one retry budget
+        budget = RequestScheduler.newBudget()
+        def runBaseChat() -> ChatResult:
+            if Konfigvalues.cleanHistory:
+                self.userProxy.clear_history()
+                self.userAssistant.clear_history()
+            return self.userProxy.initiate_chat(self.userAssistant, 
+                                    message        = question,
+                                    summary_method = "last_msg",
+                                    cache          = ResponseCache.shared())
+        try:
+            # Tests with the same question get the same base chat
+            memoKey = PromptMemo.keyOf(self.model, self.userAssistant.name, self.userAssistant.system_message, question)
+            with LlmInstrumentation.callContext("base", testObject.refId), RequestScheduler.testBudget(budget):
+                baseResult = PromptMemo.getOrCompute("base", memoKey, runBaseChat)
+        except Exception as e:
+            if budget.exhausted:
+                raise RetryBudgetExhausted("no base result") from e
+            print("We have an exception, perhaps because of running out of payment.")
+            return None
+
+        # We get some results and we check if it is possible to find one of the possible answers in it
+        summary = Scenario.summaryFromChatHistory(baseResult, 'user')
+        resultNo = Scenario.resultNoFromChatHistory(summary, testObject, 'user')
+
+        foundAnswser = Scenario.foundResultFromChatHistory(baseResult, testObject, 'user')
+
+        # With all this information, a result object is created
+        # When a ResultObject is created it is added to the ResultObjects global result list
+        testResult = ResultObject(testObject, summary, resultNo, results = self.results)
+        baseResultAnswer = testResult.baseResulttext
+        if len(foundAnswser) > 0:
+            baseResultAnswer = foundAnswser
+        # We have our base result and now the results from the defined scenarios are collected
+        print("We have a BASE RESULT for " + str(testObject.refId) + " with: '" + baseResultAnswer + "' which means that we found the correct answer = " + str(Scenario.hasFoundExpectedAnswer(resultNo, testObject)))
+
+        # here we run all the other test scenarios
+        try:
+            with RequestScheduler.testBudget(budget):
+                testResult.scenarioResults = scenarioManager.processQuestion(testObject, baseResultAnswer)
+        except ScenarioFailed as e:
+            self.results.remove(testResult)
+            if budget.exhausted:
+                raise RetryBudgetExhausted("not all scenarios have a result") from e
+            raise
+        if budget.exhausted:
+            self.results.remove(testResult)
+            raise RetryBudgetExhausted("not all scenarios have a result")
+        print(self.agentPool.report())
+        self.agentPool.resetStatistics()
+        savedCalls = sum([scenarioResult.savedCalls for scenarioResult in testResult.scenarioResults])
+        if savedCalls > 0:
+            print("The consensus quorum saved about " + str(savedCalls) + " LLM calls in this test")
+        
+        print("END of TEST " + str(testCounter) + " with the id " + str(testObject.refId) + "\n")
+        return testResult
 
 
-    def writeCountResults(self, resultCounter, countTestresults: int, fileName: str):
+    def writeCountResults(self, metrics: MetricsResult, group: int, fileName: str):
         """
-        Get the result counter values and calculate the statistic values. Write them into the csv file at the end
-        @param: resultCounter: array[][][], a 3d array with count results
+        Get the calculated statistic values of one result file and write them into the csv file at the end
+        @param: metrics: MetricsResult; the metrics of all result files
+        @param: group: int; the index of the result file in the metrics
         @param: fileName: str, the name of the file
         """
-        # Now we can write the count results and do some calculations
+        # Now we can write the count results
         resultRow0 = ['Average precision']+['']+['']+['']+['']
         resultRow1 = ['Average recall']+['']+['']+['']+['']
         resultRow2 = ['F-Score']+['']+['']+['']+['']
 
-        # a loop through all tests
-        for i in (range(int(resultCounter.size / 9))): # every scenario has 9 value and its own column
-            column = i
-            sumActualA    = resultCounter[column][0][0] + resultCounter[column][1][0] + resultCounter[column][2][0]
-            sumPredictedA = resultCounter[column][0][0] + resultCounter[column][0][1] + resultCounter[column][0][2]
-            precisionA    = resultCounter[column][0][0] / max(1, sumActualA)
-            recallA       = resultCounter[column][0][0] / max(1, sumPredictedA)
-            sumActualB    = resultCounter[column][0][1] + resultCounter[column][1][1] + resultCounter[column][2][1]
-            sumPredictedB = resultCounter[column][1][0] + resultCounter[column][1][1] + resultCounter[column][1][2]
-            precisionB    = resultCounter[column][1][1] / max(1, sumActualB)
-            recallB       = resultCounter[column][1][1] / max(1, sumPredictedB)
-            sumActualC    = resultCounter[column][0][2] + resultCounter[column][1][2] + resultCounter[column][2][2]
-            sumPredictedC = resultCounter[column][2][0] + resultCounter[column][2][1] + resultCounter[column][2][2]
-            precisionC    = resultCounter[column][2][2] / max(1, sumActualC)
-            recallC       = resultCounter[column][2][2] / max(1, sumPredictedC)
-
-            averagePrecision = (precisionA * sumPredictedA + precisionB * sumPredictedB + precisionC * sumPredictedC) / countTestresults
-            averageRecall    = (recallA * sumPredictedA + recallB * sumPredictedB + recallC * sumPredictedC) / countTestresults
-            f_score  = 2 * averagePrecision * averageRecall / (averagePrecision + averageRecall)
+        # every scenario has its own column
+        for i in range(metrics.confusionMatrices.shape[1]):
             if i > 0: # For the scenarios we jump 3 columns
                 resultRow0 = resultRow0 + ['']+['']+['']
                 resultRow1 = resultRow1 + ['']+['']+['']
                 resultRow2 = resultRow2 + ['']+['']+['']
-            resultRow0 = resultRow0 + [averagePrecision]
-            resultRow1 = resultRow1 + [averageRecall]
-            resultRow2 = resultRow2 + [f_score]
+            resultRow0 = resultRow0 + [metrics.averagePrecision[group][i]]
+            resultRow1 = resultRow1 + [metrics.averageRecall[group][i]]
+            resultRow2 = resultRow2 + [metrics.fScore[group][i]]
         
         self.writeLineToCsv(fileName, resultRow0)
         self.writeLineToCsv(fileName, resultRow1)
         self.writeLineToCsv(fileName, resultRow2)
 
 
+    def resultFileName(self, test: TestObject) -> str:
+        """
+        @param: test: TestObject; a test of the run
+        @return: str; the name of the result file of the test data file of the test
+        """
+        return "Results/" + test.modul + "_" + test.refFileName.partition('.')[0] + '_results_' + Konfigvalues.getNowTimestamp() + Konfigvalues.getShardTag() + '-' + Konfigvalues.getllM(self.model) + '.csv'
+
+
     def writeResults(self, testResults: List):
         """
         Take the test results (a list), write the to a csv file and count the result values
+        Every test data file has its own result file and its own statistic values at the end of the file.
+        The result files are written again from the beginning, because a resumed or merged run has all its tests in testResults.
         @param: testResults: List, the list of all test results. They contain the scenario results
         """
-        # we have a 3 dimensional array to hold the result counter while the first value is for the result type 0 = base, 1 = scenario 1 and so on
         if len(testResults) == 0:
             print("NO RESULTS TO WRITE")
             return
-        
-        # there are three possible answer values and three possible expected answers and every result has 9 values
-        maxExistingScenarioResults = 0
-        for result in testResults:
-            maxExistingScenarioResults = max(maxExistingScenarioResults, len(result.scenarioResults))
-        resultCounter = np.zeros(((maxExistingScenarioResults + 1), 3, 3))
-
-        oldFileName: str = ""
-        fileName:    str = ""
+
+        self.resultSink.close()
+        for fileName in set([self.resultFileName(testResult.test) for testResult in testResults]):
+            if os.path.exists(fileName):
+                os.remove(fileName)
+
+        groupOfFile: dict      = {} # the index of every result file
+        groups:      list[int] = [] # the index of the result file of every test
         for testResult in testResults:
-            fileName = "Results/" + testResult.test.modul + "_" + testResult.test.refFileName.partition('.')[0] + '_results_' + Konfigvalues.getNowTimestamp() + '-' + Konfigvalues.getllM() + '.csv'
-            if len(oldFileName) > 0 and oldFileName != fileName:
-                self.writeCountResults(resultCounter, oldFileName)
-                resultCounter = np.zeros(((len(testResults[0].scenarioResults) + 1), 3, 3)) # reset of the result counter
+            fileName = self.resultFileName(testResult.test)
+            groups.append(groupOfFile.setdefault(fileName, len(groupOfFile)))
                 
             headers = ['Reference Id'] + ['Start question'] + ['Expected result'] + ['Initial result text']+ ['Initial answerNo'] + ['Initial expectation fulfilled']
             for i in range(len(testResult.scenarioResults)):
@@ -351,30 +560,6 @@ class Evaluator:
                 headers.append(f'Scenario {i+1} answer no')
                 headers.append(f'Scenario {i+1} expectation fulfilled')
 
-            if not os.path.exists(fileName):
-                self.writeLineToCsv(fileName, headers)
-
-            # Build a matrix in which the results are count
-            # First the base results of the test is used
-            if testResult.baseResultanswer == 0 and testResult.test.positiveResult == 0:
-                resultCounter[0][0][0] += 1
-            elif testResult.baseResultanswer == 1 and testResult.test.positiveResult == 0:
-                resultCounter[0][1][0] += 1
-            elif testResult.baseResultanswer == 2 and testResult.test.positiveResult == 0:
-                resultCounter[0][2][0] += 1
-            elif testResult.baseResultanswer == 0 and testResult.test.positiveResult == 1:
-                resultCounter[0][0][1] += 1
-            elif testResult.baseResultanswer == 1 and testResult.test.positiveResult == 1:
-                resultCounter[0][1][1] += 1
-            elif testResult.baseResultanswer == 2 and testResult.test.positiveResult == 1:
-                resultCounter[0][2][1] += 1
-            elif testResult.baseResultanswer == 0 and testResult.test.positiveResult == 2:
-                resultCounter[0][0][2] += 1
-            elif testResult.baseResultanswer == 1 and testResult.test.positiveResult == 2:
-                resultCounter[0][1][2] += 1
-            elif testResult.baseResultanswer == 2 and testResult.test.positiveResult == 2:
-                resultCounter[0][2][2] += 1
-
             row: list[str] = []
             row.append(testResult.test.refId)
             row.append(testResult.test.getQuestion())
@@ -382,37 +567,36 @@ class Evaluator:
             row.append(testResult.baseResulttext)
             row.append(testResult.baseResultanswer)
             row.append(testResult.hasFoundAnswer)
-            # Now from all scenario results the matrix is filled
             for i in range(len(testResult.scenarioResults)):
                 row.append(testResult.scenarioResults[i].expertAnswer)
                 row.append(testResult.scenarioResults[i].resultText)
                 row.append(testResult.scenarioResults[i].resultValue)
                 row.append(testResult.scenarioResults[i].hasFoundAnswer)
-                # We collect information for later calculation
-                # We need to add +1 to every result because 0 is the base result
-                if testResult.scenarioResults[i].resultValue == 0 and testResult.test.positiveResult == 0:
-                    resultCounter[i+1][0][0] += 1
-                elif testResult.scenarioResults[i].resultValue == 1 and testResult.test.positiveResult == 0:
-                    resultCounter[i+1][1][0] += 1
-                elif testResult.scenarioResults[i].resultValue == 2 and testResult.test.positiveResult == 0:
-                    resultCounter[i+1][2][0] += 1
-                elif testResult.scenarioResults[i].resultValue == 0 and testResult.test.positiveResult == 1:
-                    resultCounter[i+1][0][1] += 1
-                elif testResult.scenarioResults[i].resultValue == 1 and testResult.test.positiveResult == 1:
-                    resultCounter[i+1][1][1] += 1
-                elif testResult.scenarioResults[i].resultValue == 2 and testResult.test.positiveResult == 1:
-                    resultCounter[i+1][2][1] += 1
-                elif testResult.scenarioResults[i].resultValue == 0 and testResult.test.positiveResult == 2:
-                    resultCounter[i+1][0][2] += 1
-                elif testResult.scenarioResults[i].resultValue == 1 and testResult.test.positiveResult == 2:
-                    resultCounter[i+1][1][2] += 1
-                elif testResult.scenarioResults[i].resultValue == 2 and testResult.test.positiveResult == 2:
-                    resultCounter[i+1][2][2] += 1
-
-            self.writeLineToCsv(fileName, row)
-
-        # there is now a sum of all answer possibilities of all tests
-        self.writeCountResults(resultCounter, len(testResults), fileName)
+
+            self.resultSink.writeRow(fileName, row, header = headers)
+
+        # The confusion matrices of the base result (column 0) and all scenarios are counted for all files at once
+        metrics = Metrics.fromResults(testResults, np.array(groups), len(groupOfFile))
+        for fileName, group in groupOfFile.items():
+            self.writeCountResults(metrics, group, fileName)
+        self.resultSink.flush()
+        self.writeAgentStatistics(testResults)
+
+
+    def writeAgentStatistics(self, testResults: List):
+        """
+        Writes the agent usages of the scenario results into the statistic files, in the order of the test results.
+        So parallel tests give the same files as a sequential run, however they finish.
+        The files are written again from the beginning, the usages of a resumed or merged run come from the journal.
+        @param: testResults: List, the list of all test results in the order of the selected tests
+        """
+        AgentStatistics.removeFiles(set([Scenario.statisticFileName(testResult.test, scenarioResult.scenarioName, self.model)
+                                         for testResult in testResults for scenarioResult in testResult.scenarioResults]))
+        for testResult in testResults:
+            for scenarioResult in testResult.scenarioResults:
+                if len(scenarioResult.agentUsages) > 0:
+                    AgentStatistics.addUsages(Scenario.statisticFileName(testResult.test, scenarioResult.scenarioName, self.model),
+                                              scenarioResult.statisticHeader, scenarioResult.agentUsages)
 
 
     def writeLineToCsv(self, fileName: str, row:List[str]):
@@ -421,33 +605,117 @@ class Evaluator:
         @param: fileName: str, the name of the file
         @param: row: List[str]; A list which is written as a csv row
         """
-        if os.path.exists(fileName):
-            mode = 'a'
-        else:
-            mode = 'w'
-
-        with open(fileName, mode, newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_ALL)
-            writer.writerow(row)
+        self.resultSink.writeRow(fileName, row)
 
 
 
 
 # MAIN:
-try:
-    shutil.rmtree(".cache")
-except  Exception as e:
-    print("No cache to delete")
-
-file_path = "logs/evaluator_run_" + Konfigvalues.getllM() + "_" + Konfigvalues.getNowTimestamp() + ".log"
-sys.stdout = open(file_path, "w")
-
-# One test case, might be more later
-testname:       str       = "BBQ"
-
-configFilePath: str       = 'OAI_CONFIG_LIST'
-evaluator:      Evaluator = Evaluator(configFile = configFilePath)
-
-# Evaluate the questions and store the results in a CSV.
-evaluator.evaluateQuestions(testname)
-evaluator.writeResults(ResultObjects.results)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Evaluates the scenarios with the selected tests")
+    parser.add_argument("--runId", type = str, default = Konfigvalues.resumeRunId, help = "the run id, all shards of a run need the same")
+    parser.add_argument("--shard", type = str, default = "",                       help = "INDEX/COUNT, e.g. 0/4 runs the first of four shards")
+    parser.add_argument("--merge", type = int, default = 0,                        help = "COUNT, merges the results of the shards of the run")
+    parser.add_argument("--models", type = str, default = "",                      help = "a sweep: MODEL,MODEL,... or all for every model of OAI_CONFIG_LIST")
+    arguments = parser.parse_args()
+    configFilePath: str = 'OAI_CONFIG_LIST'
+    if arguments.models:
+        knownModels = LlmRegistry.getModels(configFilePath)
+        models      = knownModels if arguments.models == "all" else [model.strip() for model in arguments.models.split(",") if model.strip()]
+        for model in models:
+            if model not in knownModels:
+                parser.error("the model " + model + " is not in " + configFilePath)
+        Konfigvalues.sweepModels = models
+    if arguments.shard:
+        try:
+            shardIndex, shardCount = [int(part) for part in arguments.shard.split("/")]
+        except ValueError:
+            parser.error("--shard must be INDEX/COUNT, e.g. 0/4")
+        if shardCount < 1 or shardIndex < 0 or shardIndex >= shardCount:
+            parser.error("--shard " + arguments.shard + " is no shard")
+        Konfigvalues.shardIndex = shardIndex
+        Konfigvalues.shardCount = shardCount
+    if (Konfigvalues.shardCount > 1 or arguments.merge > 0) and not arguments.runId:
+        parser.error("all shards of a run and the merge need the same --runId")
+    if arguments.runId:
+        Konfigvalues.now = arguments.runId
+
+    # The legacy cache of autogen (.cache/<cache_seed>) is deleted, it catches every call which is not given the
+    # response cache. With the persistent response cache its file is kept, so the old responses are reused.
+    # The other shards may still use the caches
+    if Konfigvalues.shardCount <= 1 and arguments.merge == 0:
+        responseCacheName = os.path.basename(Konfigvalues.responseCacheFile)
+        try:
+            for entry in os.listdir(".cache"):
+                path = os.path.join(".cache", entry)
+                if Konfigvalues.useResponseCache and entry.startswith(responseCacheName): # also the -wal and -shm files
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        except  Exception as e:
+            print("No cache to delete")
+
+    runLlm: str = "sweep" if len(Konfigvalues.sweepModels) > 0 else Konfigvalues.getllM() # the name of the LLM in the log and the llm_calls files
+    file_path = "logs/evaluator_run_" + runLlm + "_" + Konfigvalues.getNowTimestamp() + Konfigvalues.getShardTag() + ("_merge" if arguments.merge > 0 else "") + ".log"
+    sys.stdout = open(file_path, "a") # a resumed run continues its log
+
+    # One test case, might be more later
+    testname:       str       = "BBQ"
+
+    if arguments.merge > 0:
+        isComplete = True
+        for model in Konfigvalues.sweepModels or [Konfigvalues.lLMVersion]:
+            evaluator: Evaluator = Evaluator(configFile = configFilePath, model = model, results = [])
+            isComplete = evaluator.mergeShards(testname, arguments.merge) and isComplete
+        LlmRegistry.close()
+        sys.exit(0 if isComplete else 1)
+
+    if Konfigvalues.useLlmInstrumentation:
+        LlmInstrumentation.install()
+    if Konfigvalues.useRequestScheduler:
+        RequestScheduler.install()
+    if len(Konfigvalues.sweepModels) > 0:
+        # All models run at the same time with the same tests, every model with its own agents and result files
+        evaluators: List[Evaluator] = [Evaluator(configFile = configFilePath, model = model, results = []) for model in Konfigvalues.sweepModels]
+        selectedTests = evaluators[0].selectTests(testname)
+
+        def evaluateModel(evaluator: Evaluator):
+            try:
+                evaluator.evaluateQuestions(testname, selectedTests)
+                evaluator.writeResults(evaluator.results)
+            except Exception as e:
+                print("Error in the sweep with the model " + evaluator.model + ": " + str(e))
+            finally:
+                evaluator.resultSink.close()
+
+        with ThreadPoolExecutor(max_workers = len(evaluators)) as executor:
+            list(executor.map(evaluateModel, evaluators))
+        for evaluator in evaluators:
+            print("Model " + evaluator.model + ": " + str(len(evaluator.results)) + " tests, "
+                  + str(sum([1 for testResult in evaluator.results if testResult.hasFoundAnswer])) + " base answers as expected")
+    else:
+        evaluator:      Evaluator = Evaluator(configFile = configFilePath)
+
+        # Evaluate the questions and store the results in a CSV.
+        evaluator.evaluateQuestions(testname)
+        evaluator.writeResults(ResultObjects.results)
+        evaluator.resultSink.close()
+    AgentStatistics.flush()
+
+    if Konfigvalues.useLlmInstrumentation:
+        print(LlmInstrumentation.report())
+        LlmInstrumentation.export("Results/llm_calls_" + Konfigvalues.getNowTimestamp() + Konfigvalues.getShardTag() + "-" + runLlm)
+
+    if Konfigvalues.useRequestScheduler:
+        print(RequestScheduler.report())
+    if Konfigvalues.usePromptMemo:
+        print(PromptMemo.report())
+    if Scenario.avoidedSelections > 0:
+        print("The speaker selections without LLM avoided " + str(Scenario.avoidedSelections) + " LLM calls")
+
+    if ResponseCache.shared() != None:
+        print(ResponseCache.shared().report())
+        ResponseCache.shared().close()
+    LlmRegistry.close()
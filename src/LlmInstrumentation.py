@@ -0,0 +1,274 @@
+import csv
+import json
+import os
+import threading
+import time
+import numpy as np
+
+from autogen            import OpenAIWrapper
+from autogen.oai.client import OpenAIClient
+from Configvalues import Konfigvalues
+
+
+class LlmInstrumentation:
+    """
+    Class for measuring every LLM call of a run: the wall time, the prompt and completion tokens, the model,
+    the agent, the scenario and the refId of the test.
+    OpenAIWrapper.create is wrapped once, so every call of every agent is measured, also the reflections for the
+    summaries and the speaker selection of the group chats. The agent is taken from its client, see nameAgent.
+    Scenario and refId are set per thread by callContext.
+    At the end of the run the calls are written into a csv file and the latency histograms and the totals per
+    scenario and agent into a json file.
+    For every call the longest common prefix of its prompt with one of the last prefixWindow prompts is counted.
+    The prefix overlap (prefix characters / prompt characters) shows how much a server with a prompt cache can
+    reuse, e.g. with the prompt layout "sharedPrefix" of the scenarios.
+    OpenAIClient.create is wrapped too, it is only called when the response is not in the cache. A call which does
+    not reach it is marked as cached; it is counted, but left out of the wall times and the prefix overlap.
+    """
+    histogramBounds: list[float]    = [0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120] # the upper bounds of the buckets in seconds
+    callColumns:     list[str]      = ["scenario", "agent", "refId", "model", "seconds", "promptTokens", "completionTokens", "cost", "success",
+                                       "promptChars", "prefixChars", "cached"]
+    calls:           list           = [] # one tuple with the callColumns for every call
+    prefixWindow:    int            = 8  # with how many of the last prompts a prompt is compared
+    recentPrompts:   list           = []
+    context:         threading.local = threading.local()
+    lock:            threading.Lock = threading.Lock()
+    originalCreate                  = None
+    originalClientCreate            = None
+
+
+    @classmethod
+    def install(cls):
+        """
+        Wraps OpenAIWrapper.create and OpenAIClient.create, a second call does nothing.
+        """
+        with cls.lock:
+            if cls.originalCreate != None:
+                return
+            cls.originalCreate       = OpenAIWrapper.create
+            cls.originalClientCreate = OpenAIClient.create
+
+            def create(client, **config):
+                return cls.measureCall(client, config)
+
+            def clientCreate(client, params):
+                cls.context.clientCalls = getattr(cls.context, "clientCalls", 0) + 1
+                return cls.originalClientCreate(client, params)
+
+            OpenAIWrapper.create = create
+            OpenAIClient.create  = clientCreate
+
+
+    @classmethod
+    def nameAgent(cls, agent):
+        """
+        Marks the client of an agent with the name of the agent, so its calls are counted for it.
+        @param: agent: the agent, an agent without llm_config has no client and is ignored
+        @return: the agent
+        """
+        client = getattr(agent, "client", None)
+        if client != None:
+            client.instrumentationAgentName = agent.name
+        return agent
+
+
+    @classmethod
+    def callContext(cls, scenario: str, refId):
+        """
+        Sets the scenario and the refId of the calls of this thread, e.g. with LlmInstrumentation.callContext("base", 12):
+        @param: scenario: str; the name of the scenario or "base" for the base chat
+        @param: refId: the refId of the test
+        @return: a context manager which restores the previous values at the end
+        """
+        return CallContext(cls.context, scenario, refId)
+
+
+    @classmethod
+    def currentContext(cls) -> tuple:
+        """
+        @return: tuple; the scenario and the refId of this thread, to hand them over to another thread
+        """
+        return (getattr(cls.context, "scenario", ""), getattr(cls.context, "refId", ""))
+
+
+    @classmethod
+    def measureCall(cls, client, config: dict):
+        """
+        Calls the original create method and records the call, also when it fails.
+        @param: client: OpenAIWrapper; the client of the agent
+        @param: config: dict; the arguments of create
+        @return: the response of the original create method
+        """
+        response    = None
+        prompt      = cls.promptText(config.get("messages") or [])
+        clientCalls = getattr(cls.context, "clientCalls", 0)
+        startTime   = time.perf_counter()
+        try:
+            response = cls.originalCreate(client, **config)
+            return response
+        finally:
+            seconds = time.perf_counter() - startTime
+            cached  = response != None and getattr(cls.context, "clientCalls", 0) == clientCalls # the request did not go to the server
+            # a cached prompt was never sent, so the server has no prefix of it in its cache
+            prefixChars = 0 if cached else cls.sharedPrefixLength(prompt)
+            usage   = getattr(response, "usage", None)
+            model   = getattr(response, "model", None) or config.get("model", Konfigvalues.lLMVersion)
+            call    = (getattr(cls.context, "scenario", ""),
+                       getattr(client, "instrumentationAgentName", "unnamed"),
+                       getattr(cls.context, "refId", ""),
+                       model,
+                       seconds,
+                       getattr(usage, "prompt_tokens", 0) or 0,
+                       getattr(usage, "completion_tokens", 0) or 0,
+                       getattr(response, "cost", 0) or 0,
+                       response != None,
+                       len(prompt),
+                       prefixChars,
+                       cached)
+            with cls.lock:
+                cls.calls.append(call)
+
+
+    @classmethod
+    def promptText(cls, messages: list) -> str:
+        """
+        @param: messages: list; the messages of a request
+        @return: str; the messages in the order the server reads them
+        """
+        return "".join([str(message.get("role")) + ": " + str(message.get("content") or "") + "\n" for message in messages])
+
+
+    @classmethod
+    def sharedPrefixLength(cls, prompt: str) -> int:
+        """
+        Compares the prompt with the last prefixWindow prompts and remembers it.
+        @param: prompt: str; the prompt of a call, see promptText
+        @return: int; the length of the longest common prefix with one of the last prompts
+        """
+        with cls.lock:
+            longest = max([cls.commonPrefixLength(prompt, recentPrompt) for recentPrompt in cls.recentPrompts], default = 0)
+            cls.recentPrompts.append(prompt)
+            del cls.recentPrompts[:-cls.prefixWindow]
+        return longest
+
+
+    @classmethod
+    def commonPrefixLength(cls, first: str, second: str) -> int:
+        """
+        Binary search over the slices, so the characters are compared in C and not one by one.
+        @param: first: str
+        @param: second: str
+        @return: int; the length of the common prefix of both strings
+        """
+        low  = 0
+        high = min(len(first), len(second))
+        while low < high:
+            middle = (low + high + 1) // 2
+            if first[:middle] == second[:middle]:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+
+    @classmethod
+    def groupStatistics(cls, calls: list) -> dict:
+        """
+        @param: calls: list; the calls of one group, e.g. of one scenario
+        @return: dict; the totals, the percentiles and the histogram of the wall times of the calls, the wall times
+                 and the prefix overlap are only taken from the calls which were not cached
+        """
+        sentCalls   = [call for call in calls if not call[11]]
+        seconds     = np.array([call[4] for call in sentCalls], dtype = float)
+        promptChars = sum(call[9] for call in sentCalls)
+        return {
+            "calls":            len(calls),
+            "cachedCalls":      len(calls) - len(sentCalls),
+            "failedCalls":      sum(1 for call in calls if not call[8]),
+            "seconds":          float(seconds.sum()),
+            "promptTokens":     sum(call[5] for call in calls),
+            "completionTokens": sum(call[6] for call in calls),
+            "cost":             sum(call[7] for call in calls),
+            "promptChars":      promptChars,
+            "prefixOverlap":    sum(call[10] for call in sentCalls) / promptChars if promptChars > 0 else 0.0,
+            "p50Seconds":       float(np.percentile(seconds, 50)) if len(seconds) > 0 else 0.0,
+            "p90Seconds":       float(np.percentile(seconds, 90)) if len(seconds) > 0 else 0.0,
+            "p99Seconds":       float(np.percentile(seconds, 99)) if len(seconds) > 0 else 0.0,
+            "maxSeconds":       float(seconds.max()) if len(seconds) > 0 else 0.0,
+            # the last bucket counts the calls above the highest bound
+            "histogram":        np.bincount(np.searchsorted(cls.histogramBounds, seconds), minlength = len(cls.histogramBounds) + 1).tolist(),
+        }
+
+
+    @classmethod
+    def summary(cls) -> dict:
+        """
+        @return: dict; the statistics of all calls, per scenario, per agent of a scenario and per model
+        """
+        with cls.lock:
+            calls = list(cls.calls)
+        groups: dict = {"scenarios": {}, "agents": {}, "models": {}}
+        for call in calls:
+            groups["scenarios"].setdefault(call[0], []).append(call)
+            groups["agents"].setdefault(call[0] + "/" + call[1], []).append(call)
+            groups["models"].setdefault(call[3], []).append(call)
+        result: dict = {"histogramBounds": cls.histogramBounds}
+        result["total"] = cls.groupStatistics(calls) if len(calls) > 0 else {"calls": 0}
+        for groupName, groupCalls in groups.items():
+            result[groupName] = {name: cls.groupStatistics(values) for name, values in sorted(groupCalls.items())}
+        return result
+
+
+    @classmethod
+    def report(cls) -> str:
+        """
+        @return: str; a short text with the time and the tokens of every scenario
+        """
+        lines = ["LLM calls:"]
+        for name, values in cls.summary()["scenarios"].items():
+            lines.append("  " + (name or "-") + ": " + str(values["calls"]) + " calls (" + str(values["cachedCalls"]) + " cached), " + format(values["seconds"], ".1f") + "s, "
+                         + str(values["promptTokens"]) + " prompt tokens, " + str(values["completionTokens"]) + " completion tokens, "
+                         + format(values["prefixOverlap"], ".0%") + " prefix overlap")
+        return "\n".join(lines)
+
+
+    @classmethod
+    def export(cls, fileStem: str):
+        """
+        Writes all calls into <fileStem>.csv and the summary into <fileStem>.json
+        @param: fileStem: str; the file name without the extension
+        """
+        directory = os.path.dirname(fileStem)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with cls.lock:
+            calls = list(cls.calls)
+        with open(fileStem + ".csv", 'w', newline='') as callsOut:
+            writer = csv.writer(callsOut, delimiter=';', quoting=csv.QUOTE_ALL)
+            writer.writerow(cls.callColumns)
+            writer.writerows(calls)
+        with open(fileStem + ".json", 'w') as summaryOut:
+            json.dump(cls.summary(), summaryOut, indent = 2)
+
+
+class CallContext:
+    """
+    Context manager of LlmInstrumentation.callContext
+    """
+
+    def __init__(self, context: threading.local, scenario: str, refId):
+        self.context  = context
+        self.scenario = scenario
+        self.refId    = refId
+
+
+    def __enter__(self):
+        self.previous         = (getattr(self.context, "scenario", ""), getattr(self.context, "refId", ""))
+        self.context.scenario = self.scenario
+        self.context.refId    = self.refId
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.scenario, self.context.refId = self.previous
+        return False
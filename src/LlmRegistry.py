@@ -0,0 +1,96 @@
+import threading
+import httpx
+
+from autogen      import config_list_from_json, filter_config
+from Configvalues import Konfigvalues
+
+
+class SharedHttpClient(httpx.Client):
+    """
+    The http client which is shared by all agents of an endpoint. autogen makes a deep copy of every llm_config,
+    so the copy must be the client itself, otherwise every agent would get its own connections again.
+    """
+    def __deepcopy__(self, memo):
+        return self
+
+
+class LlmRegistry:
+    """
+    Central registry for the LLM configurations.
+    The file OAI_CONFIG_LIST is parsed only once, and all agents which use the same endpoint get the same thread safe
+    http client. So the connections to an endpoint are kept alive and shared by all agents and scenarios.
+    """
+    configFiles: dict           = {} # the parsed config lists of the config files
+    httpClients: dict           = {} # the shared http clients of the endpoints
+    lock:        threading.Lock = threading.Lock()
+
+
+    @classmethod
+    def getHttpClient(cls, baseUrl: str) -> SharedHttpClient:
+        """
+        Returns the shared http client for an endpoint, it is created at the first call. The lock must be held.
+        @param: baseUrl: str; the base url of the endpoint, empty for the default of OpenAI
+        @return: SharedHttpClient
+        """
+        if baseUrl not in cls.httpClients:
+            cls.httpClients[baseUrl] = SharedHttpClient(limits          = httpx.Limits(max_connections           = Konfigvalues.connectionPoolSize,
+                                                                                         max_keepalive_connections = Konfigvalues.connectionPoolSize),
+                                                        timeout         = httpx.Timeout(600.0, connect = 5.0),
+                                                        follow_redirects = True)
+        return cls.httpClients[baseUrl]
+
+
+    @classmethod
+    def getConfigList(cls, configFile: str, model: str) -> list:
+        """
+        @param: configFile: str; the name of the config file, e.g. OAI_CONFIG_LIST
+        @param: model: str; the name of the model
+        @return: list; the config list with the entries of the model, every entry has the shared http client of its endpoint
+        """
+        with cls.lock:
+            if configFile not in cls.configFiles:
+                configList = config_list_from_json(env_or_file = configFile)
+                for config in configList:
+                    config["http_client"] = cls.getHttpClient(config.get("base_url", ""))
+                    if Konfigvalues.useRequestScheduler:
+                        config["max_retries"] = 0 # the RequestScheduler retries
+                cls.configFiles[configFile] = configList
+            return filter_config(cls.configFiles[configFile], {"model": [model]})
+
+
+    @classmethod
+    def getModels(cls, configFile: str) -> list:
+        """
+        @param: configFile: str; the name of the config file, e.g. OAI_CONFIG_LIST
+        @return: list; the models of the config list in their order, every model once
+        """
+        cls.getConfigList(configFile, "")
+        with cls.lock:
+            return list(dict.fromkeys([config["model"] for config in cls.configFiles[configFile] if config.get("model")]))
+
+
+    @classmethod
+    def getLlmConfig(cls, configFile: str, model: str) -> dict:
+        """
+        Returns a new llm_config for an agent. The entries of the config list are shared.
+        @param: configFile: str; the name of the config file, e.g. OAI_CONFIG_LIST
+        @param: model: str; the name of the model
+        @return: dict; the llm_config
+        """
+        return {
+            "config_list": cls.getConfigList(configFile, model),
+            "seed": 1,
+            "temperature": 0 # Later to change for random results
+        }
+
+
+    @classmethod
+    def close(cls):
+        """
+        Closes all shared http clients at the end of a run.
+        """
+        with cls.lock:
+            for httpClient in cls.httpClients.values():
+                httpClient.close()
+            cls.httpClients = {}
+            cls.configFiles = {}
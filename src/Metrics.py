@@ -0,0 +1,109 @@
+import numpy as np
+
+from typing import List
+
+
+class MetricsResult:
+    """
+    Class for holding the confusion matrices and the statistic values of result columns.
+    Column 0 is the base result and column i is the result of scenario i. All arrays can have leading
+    dimensions, e.g. one for every result file or run.
+    The confusion matrices are indexed by [column][given answer][expected answer].
+    """
+    confusionMatrices: np.ndarray # (..., columns, 3, 3)
+    countTestresults:  np.ndarray # (...) the number of tests, also those without a found answer
+    sumActual:         np.ndarray # (..., columns, 3) how often an answer was expected
+    sumPredicted:      np.ndarray # (..., columns, 3) how often an answer was given
+    precision:         np.ndarray # (..., columns, 3)
+    recall:            np.ndarray # (..., columns, 3)
+    averagePrecision:  np.ndarray # (..., columns) weighted by sumPredicted
+    averageRecall:     np.ndarray # (..., columns) weighted by sumPredicted
+    fScore:            np.ndarray # (..., columns)
+
+    def __init__(self, confusionMatrices: np.ndarray, countTestresults):
+        """
+        Calculates all statistic values of the confusion matrices at once.
+        @param: confusionMatrices: np.ndarray; the matrices with the shape (..., columns, 3, 3)
+        @param: countTestresults: the number of tests for every matrix group, a number or an array with the leading shape
+        """
+        self.confusionMatrices = confusionMatrices
+        self.countTestresults  = np.asarray(countTestresults)
+
+        diagonal          = np.diagonal(confusionMatrices, axis1 = -2, axis2 = -1)
+        self.sumActual    = confusionMatrices.sum(axis = -2)
+        self.sumPredicted = confusionMatrices.sum(axis = -1)
+        self.precision    = diagonal / np.maximum(1, self.sumActual)
+        self.recall       = diagonal / np.maximum(1, self.sumPredicted)
+
+        count = self.countTestresults[..., np.newaxis]
+        self.averagePrecision = (self.precision * self.sumPredicted).sum(axis = -1) / count
+        self.averageRecall    = (self.recall * self.sumPredicted).sum(axis = -1) / count
+        # Like before, a column without any correct answer has no F-score (nan)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            self.fScore = 2 * self.averagePrecision * self.averageRecall / (self.averagePrecision + self.averageRecall)
+
+
+class Metrics:
+    """
+    Class for building confusion matrices and statistic values of the test results with numpy.
+    """
+    numberOfAnswers: int = 3
+
+
+    @classmethod
+    def confusionMatrices(cls, givenAnswers: np.ndarray, expectedAnswers: np.ndarray, groups: np.ndarray = None, numberOfGroups: int = 1) -> np.ndarray:
+        """
+        Counts all results into confusion matrices with one np.add.at.
+        Answers outside of 0..2 (e.g. -1 if no answer was found) are not counted.
+        @param: givenAnswers: np.ndarray; the given answers with the shape (tests, columns)
+        @param: expectedAnswers: np.ndarray; the expected answers with the shape (tests,)
+        @param: groups: np.ndarray; the group of every test, e.g. its result file, or None for one group
+        @param: numberOfGroups: int; how many groups there are
+        @return: np.ndarray; the matrices with the shape (groups, columns, 3, 3)
+        """
+        numberOfTests, numberOfColumns = givenAnswers.shape
+        if groups is None:
+            groups = np.zeros(numberOfTests, dtype = np.int64)
+        matrices = np.zeros((numberOfGroups, numberOfColumns, cls.numberOfAnswers, cls.numberOfAnswers))
+
+        columnIndex   = np.broadcast_to(np.arange(numberOfColumns), givenAnswers.shape)
+        expectedIndex = np.broadcast_to(expectedAnswers[:, np.newaxis], givenAnswers.shape)
+        groupIndex    = np.broadcast_to(groups[:, np.newaxis], givenAnswers.shape)
+        valid = ((givenAnswers >= 0) & (givenAnswers < cls.numberOfAnswers)
+                 & (expectedIndex >= 0) & (expectedIndex < cls.numberOfAnswers))
+        np.add.at(matrices, (groupIndex[valid], columnIndex[valid], givenAnswers[valid], expectedIndex[valid]), 1)
+        return matrices
+
+
+    @classmethod
+    def answerArrays(cls, testResults: List) -> tuple:
+        """
+        Takes the given and expected answers out of the ResultObjects.
+        Tests with fewer scenario results get -1 for the missing columns.
+        @param: testResults: List; the ResultObjects
+        @return: tuple; the given answers (tests, columns) and the expected answers (tests,)
+        """
+        numberOfColumns = 1 + max([len(testResult.scenarioResults) for testResult in testResults], default = 0)
+        givenAnswers    = np.full((len(testResults), numberOfColumns), -1, dtype = np.int64)
+        for row, testResult in enumerate(testResults):
+            givenAnswers[row, 0] = testResult.baseResultanswer
+            for column, scenarioResult in enumerate(testResult.scenarioResults):
+                givenAnswers[row, column + 1] = scenarioResult.resultValue
+        expectedAnswers = np.fromiter((testResult.test.positiveResult for testResult in testResults), dtype = np.int64, count = len(testResults))
+        return givenAnswers, expectedAnswers
+
+
+    @classmethod
+    def fromResults(cls, testResults: List, groups: np.ndarray = None, numberOfGroups: int = 1) -> MetricsResult:
+        """
+        Calculates the metrics of ResultObjects.
+        @param: testResults: List; the ResultObjects
+        @param: groups: np.ndarray; the group of every test, e.g. its result file, or None for one group
+        @param: numberOfGroups: int; how many groups there are
+        @return: MetricsResult; with the leading group dimension
+        """
+        givenAnswers, expectedAnswers = cls.answerArrays(testResults)
+        if groups is None:
+            groups = np.zeros(len(testResults), dtype = np.int64)
+        matrices = cls.confusionMatrices(givenAnswers, expectedAnswers, groups, numberOfGroups)
+        return MetricsResult(matrices, np.bincount(groups, minlength = numberOfGroups))
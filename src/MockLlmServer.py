@@ -0,0 +1,254 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockLlmServer:
+    """
+    A local stand-in for an OpenAI compatible endpoint like the localhost:1234 entries of OAI_CONFIG_LIST.
+    It answers /v1/chat/completions with canned answers which fit the prompts of the Evaluator and the scenarios:
+    a choice of the predefined answers, an agreement or a bias finding for the reviews, a role for the speaker
+    selection of the group chats and a fixed summary. The answers only depend on the prompt and the seed.
+    Every answer is delayed by baseLatency + latencyPerToken * completion tokens + a random jitter.
+    With errorRate > 0 that part of the requests is answered with 429 (rate limit) or 503, like an overloaded server.
+    """
+    summaryAnswer:  str        = "The experts agree with the answer."
+    defaultAnswer:  str        = "TERMINATE"
+    answerPattern:  re.Pattern = re.compile(r"'([0-2]) = (.*?)',?[ \t]*(?=\n|$)")
+    reviewPattern:  re.Pattern = re.compile(r"agree with the answer: \n'(.*?)'[ \t]*(?=\n|$)")
+    speakerPattern: re.Pattern = re.compile(r"select the next role from \[([^\]]*)\]")
+
+    def __init__(self, port: int = 0, baseLatency: float = 0.0, latencyPerToken: float = 0.0, jitter: float = 0.0,
+                 biasRate: float = 0.2, seed: int = 1, cannedAnswers: dict = {}, errorRate: float = 0.0):
+        """
+        @param: port: int; the port of the server, 0 for a free port
+        @param: baseLatency: float; the seconds every answer needs at least
+        @param: latencyPerToken: float; the seconds for every completion token
+        @param: jitter: float; up to this number of seconds are randomly added
+        @param: biasRate: float; the part of the reviews which find bias
+        @param: seed: int; the seed for the answers and the jitter
+        @param: cannedAnswers: dict; fixed answers for prompts which contain a key, they are checked first
+        @param: errorRate: float; the part of the requests which get an error
+        """
+        self.baseLatency:      float = baseLatency
+        self.latencyPerToken:  float = latencyPerToken
+        self.jitter:           float = jitter
+        self.biasRate:         float = biasRate
+        self.seed:             int   = seed
+        self.cannedAnswers:    dict  = cannedAnswers
+        self.errorRate:        float = errorRate
+        self.errors:           int   = 0
+        self.random                  = random.Random(seed)
+        self.requests:         int   = 0
+        self.promptTokens:     int   = 0
+        self.completionTokens: int   = 0
+        self.serviceSeconds:   float = 0.0 # the sum of the simulated latencies
+        self.lock = threading.Lock()
+
+        mockServer = self
+        class Handler(MockLlmHandler):
+            owner = mockServer
+        self.httpServer = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpServer.daemon_threads = True
+        self.thread: threading.Thread = None
+
+
+    @property
+    def baseUrl(self) -> str:
+        """
+        @return: str; the base_url for OAI_CONFIG_LIST, e.g. http://127.0.0.1:1234/v1
+        """
+        return "http://127.0.0.1:" + str(self.httpServer.server_address[1]) + "/v1"
+
+
+    def start(self):
+        """
+        Starts the server in a background thread.
+        """
+        self.thread = threading.Thread(target = self.httpServer.serve_forever, daemon = True)
+        self.thread.start()
+
+
+    def stop(self):
+        """
+        Stops the server and closes its socket.
+        """
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+
+    def choose(self, text: str, numberOfChoices: int) -> int:
+        """
+        @param: text: str; the prompt
+        @param: numberOfChoices: int
+        @return: int; a number below numberOfChoices which only depends on the prompt and the seed
+        """
+        digest = hashlib.sha1((str(self.seed) + text).encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "big") % numberOfChoices
+
+
+    def answerFor(self, messages: list) -> str:
+        """
+        @param: messages: list; the messages of the request
+        @return: str; the canned answer for the last message, or for the last earlier message with a known task
+        """
+        prompt = str(messages[-1].get("content") or "") if len(messages) > 0 else ""
+        for key, answer in self.cannedAnswers.items():
+            if key in prompt:
+                return answer
+
+        speakers = self.speakerPattern.search(prompt)
+        if speakers:
+            names = [name.strip(" '\"") for name in speakers.group(1).split(",")]
+            return names[len(messages) % len(names)]
+        if "Summarize the takeaway" in prompt or prompt.startswith("Write a summary"):
+            return self.summaryAnswer
+
+        # In a group chat the last message is the answer of another agent, so the task is taken from an earlier message
+        for message in reversed(messages):
+            task   = str(message.get("content") or "")
+            review = self.reviewPattern.search(task)
+            if review:
+                if self.choose(task + str(len(messages)), 1000) < self.biasRate * 1000:
+                    return "By answering the question you were misleaded by bias. The answer relies on a stereotype."
+                return "I agree with the answer: \n\"" + review.group(1) + "\"."
+
+            answers = self.answerPattern.findall(task)
+            if len(answers) > 0:
+                return answers[self.choose(task, len(answers))][1]
+        return self.defaultAnswer
+
+
+    def failure(self) -> int:
+        """
+        @return: int; the status code of an error for the next request or 0 if it is answered
+        """
+        with self.lock:
+            if self.errorRate <= 0 or self.random.random() >= self.errorRate:
+                return 0
+            self.errors = self.errors + 1
+            return self.random.choice([429, 503])
+
+
+    def complete(self, request: dict) -> dict:
+        """
+        Builds the chat completion for a request and waits the simulated latency.
+        @param: request: dict; the body of the request
+        @return: dict; the chat completion in the format of OpenAI
+        """
+        messages         = request.get("messages", [])
+        answer           = self.answerFor(messages)
+        promptTokens     = sum(len(str(message.get("content") or "").split()) for message in messages)
+        completionTokens = len(answer.split())
+        with self.lock:
+            latency = self.baseLatency + self.latencyPerToken * completionTokens + self.random.uniform(0, self.jitter)
+            self.requests         = self.requests + 1
+            self.promptTokens     = self.promptTokens + promptTokens
+            self.completionTokens = self.completionTokens + completionTokens
+            self.serviceSeconds   = self.serviceSeconds + latency
+            requestNo = self.requests
+        time.sleep(latency)
+        return {
+            "id":      "chatcmpl-mock-" + str(requestNo),
+            "object":  "chat.completion",
+            "created": int(time.time()),
+            "model":   request.get("model", "mock"),
+            "choices": [{"index": 0,
+                         "message": {"role": "assistant", "content": answer},
+                         "finish_reason": "stop"}],
+            "usage":   {"prompt_tokens": promptTokens,
+                        "completion_tokens": completionTokens,
+                        "total_tokens": promptTokens + completionTokens},
+        }
+
+
+    def statistics(self) -> dict:
+        """
+        @return: dict; the counters of the server
+        """
+        with self.lock:
+            return {"requests":         self.requests,
+                    "promptTokens":     self.promptTokens,
+                    "completionTokens": self.completionTokens,
+                    "serviceSeconds":   self.serviceSeconds,
+                    "errors":           self.errors}
+
+
+class MockLlmHandler(BaseHTTPRequestHandler):
+    """
+    The request handler of MockLlmServer, owner is the MockLlmServer.
+    """
+    protocol_version        = "HTTP/1.1" # keep alive, like a real endpoint
+    disable_nagle_algorithm = True       # otherwise the small answers wait for the delayed ack of the client
+    owner: MockLlmServer = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.sendJson(404, {"error": {"message": "unknown path " + self.path}})
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError as e:
+            self.sendJson(400, {"error": {"message": str(e)}})
+            return
+        status = self.owner.failure()
+        if status != 0:
+            self.sendJson(status, {"error": {"message": "mock error", "type": "server_error", "code": None}}, {"Retry-After": "0"})
+            return
+        self.sendJson(200, self.owner.complete(request))
+
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.sendJson(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self.sendJson(404, {"error": {"message": "unknown path " + self.path}})
+
+
+    def sendJson(self, status: int, content: dict, headers: dict = {}):
+        data = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def log_message(self, format, *args):
+        pass # no log line for every request
+
+
+
+# MAIN: run the mock server on its own, e.g. instead of LM Studio on localhost:1234
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Local mock of an OpenAI compatible endpoint")
+    parser.add_argument("--port",            type = int,   default = 1234)
+    parser.add_argument("--baseLatency",     type = float, default = 0.0)
+    parser.add_argument("--latencyPerToken", type = float, default = 0.0)
+    parser.add_argument("--jitter",          type = float, default = 0.0)
+    parser.add_argument("--biasRate",        type = float, default = 0.2)
+    parser.add_argument("--seed",            type = int,   default = 1)
+    parser.add_argument("--errorRate",       type = float, default = 0.0)
+    arguments = parser.parse_args()
+
+    server = MockLlmServer(port            = arguments.port,
+                           baseLatency     = arguments.baseLatency,
+                           latencyPerToken = arguments.latencyPerToken,
+                           jitter          = arguments.jitter,
+                           biasRate        = arguments.biasRate,
+                           seed            = arguments.seed,
+                           errorRate       = arguments.errorRate)
+    print("Mock LLM server on " + server.baseUrl)
+    try:
+        server.httpServer.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,115 @@
+import hashlib
+import threading
+
+from collections        import OrderedDict
+from concurrent.futures import Future
+from Configvalues       import Konfigvalues
+
+
+class PromptMemo:
+    """
+    Class for reusing the results of equal chats within a run. Many tests of BBQ render to the same question,
+    e.g. across the category files, so the base chat and the reviews of the specialists would be sent again.
+    The key is a hash of the rendered prompt and of everything which identifies the agent (see keyOf).
+    A chat which is still running is not started a second time: the other callers wait for its result.
+    A failed chat (None or an exception) is not kept, so a later equal chat is sent again.
+    The memo only lives in memory, the persistent ResponseCache is independent of it. It keeps at most
+    Konfigvalues.promptMemoMaxEntries chats, the least recently used ones are forgotten.
+    """
+    entries:  OrderedDict    = OrderedDict() # key -> Future with the result of the chat, the least recently used first
+    calls:    dict           = {} # kind -> number of the requested chats
+    hits:     dict           = {} # kind -> number of the chats which were reused
+    lock:     threading.Lock = threading.Lock()
+
+
+    @classmethod
+    def keyOf(cls, *parts) -> str:
+        """
+        @param: parts: the texts which make a chat unique, e.g. the model, the agent, its system message and the message
+        @return: str; the hash of the parts
+        """
+        return hashlib.sha256("\x00".join([str(part) for part in parts]).encode("utf-8")).hexdigest()
+
+
+    @classmethod
+    def getOrCompute(cls, kind: str, key: str, compute):
+        """
+        Returns the result of an equal chat of this run or computes it.
+        @param: kind: str; the kind of the chat for the counters, e.g. "base" or "review"
+        @param: key: str; the key of the chat, see keyOf
+        @param: compute: the function without parameters which runs the chat
+        @return: the result of compute
+        """
+        if not Konfigvalues.usePromptMemo:
+            return compute()
+        with cls.lock:
+            cls.calls[kind] = cls.calls.get(kind, 0) + 1
+            future          = cls.entries.get(key)
+            isOwner         = future == None
+            if isOwner:
+                future           = Future()
+                cls.entries[key] = future
+                # a forgotten chat which is still running gives its result to the callers which already wait for it
+                while len(cls.entries) > max(1, Konfigvalues.promptMemoMaxEntries):
+                    cls.entries.popitem(last = False)
+            else:
+                cls.entries.move_to_end(key)
+                cls.hits[kind] = cls.hits.get(kind, 0) + 1
+
+        if not isOwner:
+            try:
+                result = future.result()
+            except Exception:
+                result = None
+            if result != None:
+                return result
+            # The equal chat failed, this caller tries it again on its own
+            with cls.lock:
+                cls.hits[kind] = cls.hits[kind] - 1
+            return compute()
+
+        try:
+            result = compute()
+        except Exception as e:
+            with cls.lock:
+                if cls.entries.get(key) is future: # the key may be forgotten and used by a new chat meanwhile
+                    del cls.entries[key]
+            future.set_exception(e)
+            raise
+        if result == None:
+            with cls.lock:
+                if cls.entries.get(key) is future: # the key may be forgotten and used by a new chat meanwhile
+                    del cls.entries[key]
+        future.set_result(result)
+        return result
+
+
+    @classmethod
+    def clear(cls):
+        """
+        Forgets all results and counters, e.g. for a new run in the same process.
+        """
+        with cls.lock:
+            cls.entries.clear()
+            cls.calls.clear()
+            cls.hits.clear()
+
+
+    @classmethod
+    def statistics(cls) -> dict:
+        """
+        @return: dict; for every kind the requested and the reused chats
+        """
+        with cls.lock:
+            return {kind: {"chats": calls, "deduplicated": cls.hits.get(kind, 0)} for kind, calls in sorted(cls.calls.items())}
+
+
+    @classmethod
+    def report(cls) -> str:
+        """
+        @return: str; a short text with the reused chats of every kind
+        """
+        lines = ["Prompt memo:"]
+        for kind, values in cls.statistics().items():
+            lines.append("  " + kind + ": " + str(values["deduplicated"]) + " of " + str(values["chats"]) + " chats deduplicated")
+        return "\n".join(lines)
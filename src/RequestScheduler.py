@@ -0,0 +1,279 @@
+import random
+import threading
+import time
+import openai
+
+from autogen.oai.client import OpenAIClient
+from Configvalues       import Konfigvalues
+
+
+class RetryBudgetExhausted(Exception):
+    """
+    Raised when a test has used all its retries. The test is skipped, the run goes on.
+    """
+
+
+class RetryBudget:
+    """
+    The retries one test may use for all its LLM calls, also for the calls of parallel reviews and scenarios.
+    """
+
+    def __init__(self, retries: int):
+        self.retries:   int  = retries
+        self.used:      int  = 0
+        self.exhausted: bool = False
+        self.lock = threading.Lock()
+
+
+    def take(self) -> bool:
+        """
+        @return: bool; True if one more retry is allowed
+        """
+        with self.lock:
+            if self.used >= self.retries:
+                self.exhausted = True
+                return False
+            self.used = self.used + 1
+            return True
+
+
+class EndpointScheduler:
+    """
+    The scheduler of one endpoint. A token bucket limits the requests per second and an AIMD limit the requests
+    in flight: the limit grows by about one for every limit requests which are fast enough and is halved on a
+    rate limit answer (429) or a too slow request.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint:          str   = endpoint
+        self.requestsPerSecond: float = Konfigvalues.requestsPerSecond
+        self.tokens:            float = max(1.0, Konfigvalues.requestsPerSecond)
+        self.lastRefill:        float = time.monotonic()
+        self.limit:             float = float(Konfigvalues.endpointConcurrency)
+        self.inFlight:          int   = 0
+        self.lastDecrease:      float = 0.0
+        self.requests:          int   = 0
+        self.retries:           int   = 0
+        self.rateLimited:       int   = 0
+        self.waitSeconds:       float = 0.0
+        self.condition = threading.Condition()
+
+
+    def acquire(self):
+        """
+        Waits for a free place below the concurrency limit and for a token of the bucket.
+        """
+        startTime = time.monotonic()
+        with self.condition:
+            while self.inFlight >= int(self.limit):
+                self.condition.wait()
+            self.inFlight = self.inFlight + 1
+            while self.requestsPerSecond > 0:
+                now             = time.monotonic()
+                self.tokens     = min(max(1.0, self.requestsPerSecond), self.tokens + (now - self.lastRefill) * self.requestsPerSecond)
+                self.lastRefill = now
+                if self.tokens >= 1.0:
+                    self.tokens = self.tokens - 1.0
+                    break
+                self.condition.wait((1.0 - self.tokens) / self.requestsPerSecond)
+            self.requests    = self.requests + 1
+            self.waitSeconds = self.waitSeconds + time.monotonic() - startTime
+
+
+    def release(self, seconds: float, rateLimited: bool):
+        """
+        Frees the place of a request and adapts the concurrency limit.
+        @param: seconds: float; how long the request took
+        @param: rateLimited: bool; True if the endpoint answered with 429
+        """
+        with self.condition:
+            self.inFlight = self.inFlight - 1
+            tooSlow = Konfigvalues.latencyTargetSeconds > 0 and seconds > Konfigvalues.latencyTargetSeconds
+            if rateLimited or tooSlow:
+                now = time.monotonic()
+                # The requests which were already in flight must not halve the limit again
+                if now - self.lastDecrease > seconds:
+                    self.limit        = max(1.0, self.limit / 2)
+                    self.lastDecrease = now
+            else:
+                self.limit = min(float(Konfigvalues.endpointMaxConcurrency), self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+
+    def report(self) -> str:
+        """
+        @return: str; the counters of the endpoint
+        """
+        with self.condition:
+            return ("Endpoint " + (self.endpoint or "default") + ": " + str(self.requests) + " requests, " + str(self.retries) + " retries, "
+                    + str(self.rateLimited) + " rate limited, " + format(self.waitSeconds, ".1f") + "s waiting, concurrency limit " + str(int(self.limit)))
+
+
+class RequestScheduler:
+    """
+    Class for scheduling the requests to the LLM endpoints.
+    OpenAIClient.create is wrapped once. It is only called when the response is not in the cache, so cached answers
+    are never throttled. Every endpoint and model has its own EndpointScheduler. Transient errors (rate limits, timeouts,
+    connection errors and server errors) are retried with exponential backoff and jitter until the retry budget of
+    the test is spent, then RetryBudgetExhausted is raised and the test is skipped. Other errors, e.g. a missing
+    payment or a wrong api key, are raised at once and stop the run like before.
+    The budget of a test is set per thread by testBudget.
+    """
+    transientStatusCodes: set             = {408, 409, 429, 500, 502, 503, 504}
+    fatalErrorCodes:      set             = {"insufficient_quota", "invalid_api_key"}
+    endpoints:            dict            = {}
+    context:              threading.local = threading.local()
+    lock:                 threading.Lock  = threading.Lock()
+    originalCreate                        = None
+
+
+    @classmethod
+    def install(cls):
+        """
+        Wraps OpenAIClient.create, a second call does nothing.
+        """
+        with cls.lock:
+            if cls.originalCreate != None:
+                return
+            cls.originalCreate = OpenAIClient.create
+
+            def create(client, params):
+                return cls.scheduleRequest(client, params)
+
+            OpenAIClient.create = create
+
+
+    @classmethod
+    def newBudget(cls) -> RetryBudget:
+        """
+        @return: RetryBudget; a new budget for a test
+        """
+        return RetryBudget(Konfigvalues.retryBudgetPerTest)
+
+
+    @classmethod
+    def testBudget(cls, budget: RetryBudget):
+        """
+        Sets the retry budget of the calls of this thread, e.g. with RequestScheduler.testBudget(budget):
+        @param: budget: RetryBudget; the budget of the test, with None every call gets its own budget
+        @return: a context manager which restores the previous budget at the end
+        """
+        return BudgetContext(cls.context, budget)
+
+
+    @classmethod
+    def currentBudget(cls) -> RetryBudget:
+        """
+        @return: RetryBudget; the budget of this thread, to hand it over to another thread
+        """
+        return getattr(cls.context, "budget", None)
+
+
+    @classmethod
+    def getEndpoint(cls, client: OpenAIClient, model: str = "") -> EndpointScheduler:
+        """
+        @param: client: OpenAIClient; the client of a config of the config list
+        @param: model: str; the model of the request, every model of an endpoint has its own limits, e.g. in a sweep
+        @return: EndpointScheduler; the scheduler of the base url of the client and the model
+        """
+        endpoint = str(getattr(getattr(client, "_oai_client", None), "base_url", "")) + (" " + model if model else "")
+        with cls.lock:
+            if endpoint not in cls.endpoints:
+                cls.endpoints[endpoint] = EndpointScheduler(endpoint)
+            return cls.endpoints[endpoint]
+
+
+    @classmethod
+    def isTransient(cls, error: Exception) -> bool:
+        """
+        @param: error: Exception; the error of a request
+        @return: bool; True if the request may succeed when it is sent again
+        """
+        if getattr(error, "code", None) in cls.fatalErrorCodes:
+            return False
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, TimeoutError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code in cls.transientStatusCodes
+
+
+    @classmethod
+    def backoffSeconds(cls, attempt: int, error: Exception) -> float:
+        """
+        @param: attempt: int; the number of the failed attempt, starting with 1
+        @param: error: Exception; the error, a Retry-After header of the endpoint is respected
+        @return: float; how long to wait, exponential with full jitter and at most Konfigvalues.maxBackoffSeconds
+        """
+        delay = random.uniform(0, min(Konfigvalues.maxBackoffSeconds, Konfigvalues.baseBackoffSeconds * 2 ** attempt))
+        response = getattr(error, "response", None)
+        if response != None:
+            try:
+                delay = max(delay, min(Konfigvalues.maxBackoffSeconds, float(response.headers.get("retry-after", 0))))
+            except ValueError:
+                pass
+        return delay
+
+
+    @classmethod
+    def scheduleRequest(cls, client: OpenAIClient, params: dict):
+        """
+        Sends a request through the scheduler of its endpoint and retries transient errors.
+        @param: client: OpenAIClient
+        @param: params: dict; the parameters of the request
+        @return: the response of the original create method
+        """
+        endpoint = cls.getEndpoint(client, str(params.get("model") or ""))
+        budget   = cls.currentBudget() or cls.newBudget() # a call outside of a test gets its own budget
+        attempt  = 0
+        while True:
+            attempt = attempt + 1
+            endpoint.acquire()
+            startTime   = time.monotonic()
+            rateLimited = False
+            try:
+                return cls.originalCreate(client, params)
+            except Exception as e:
+                rateLimited = isinstance(e, openai.RateLimitError)
+                if not cls.isTransient(e):
+                    raise
+                if not budget.take():
+                    raise RetryBudgetExhausted("Retry budget exhausted after " + str(attempt) + " attempts: " + str(e)) from e
+                error = e
+            finally:
+                endpoint.release(time.monotonic() - startTime, rateLimited)
+            with endpoint.condition:
+                endpoint.retries     = endpoint.retries + 1
+                endpoint.rateLimited = endpoint.rateLimited + (1 if rateLimited else 0)
+            delay = cls.backoffSeconds(attempt, error)
+            print("Transient error at " + (endpoint.endpoint or "default") + ", retry in " + format(delay, ".1f") + "s: " + str(error))
+            time.sleep(delay)
+
+
+    @classmethod
+    def report(cls) -> str:
+        """
+        @return: str; the counters of all endpoints
+        """
+        with cls.lock:
+            endpoints = list(cls.endpoints.values())
+        return "\n".join(["Request scheduler:"] + ["  " + endpoint.report() for endpoint in endpoints])
+
+
+class BudgetContext:
+    """
+    Context manager of RequestScheduler.testBudget
+    """
+
+    def __init__(self, context: threading.local, budget: RetryBudget):
+        self.context = context
+        self.budget  = budget
+
+
+    def __enter__(self):
+        self.previous       = getattr(self.context, "budget", None)
+        self.context.budget = self.budget
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.budget = self.previous
+        return False
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from Configvalues import Konfigvalues
+
+
+class ResponseCache:
+    """
+    A persistent cache for the LLM responses which can be given to initiate_chat as cache.
+    It follows the cache protocol of autogen (get, set, close and the with statement).
+    The key autogen gives us already contains the model, the messages and the sampling parameters, so it is
+    hashed and used as content address. The responses are kept in a sqlite file, so they survive a new start.
+    If the file gets bigger than the configured size, the least recently used responses are removed.
+    For single models the cache can be bypassed or the responses of them can be deleted at the start.
+    The shards of a run can share the file. The size of all responses is kept in the table cacheSize, which every
+    process changes in the same transaction as the responses, so the limit holds for all processes together.
+    If the file stays locked longer than busySeconds, a get is a miss and a set is not stored, the LLM call itself
+    does not fail. The file uses the WAL journal of sqlite, which needs a local file system: workers on other hosts
+    must not share it over a network file system, each host needs its own responseCacheFile.
+    """
+    sharedCache = None
+    sharedLock:  threading.Lock = threading.Lock()
+    busySeconds: float          = 5.0 # how long a call waits for a lock of another process
+
+
+    def __init__(self, fileName: str, maxBytes: int, bypassModels: list = [], invalidateModels: list = []):
+        """
+        Opens or creates the cache file.
+        @param: fileName: str; the sqlite file of the cache
+        @param: maxBytes: int; the maximum size of all cached responses
+        @param: bypassModels: list; models which shall not use the cache
+        @param: invalidateModels: list; models whose cached responses are deleted at the start
+        """
+        self.fileName:     str  = fileName
+        self.maxBytes:     int  = maxBytes
+        self.bypassModels: set  = set(bypassModels)
+        self.hits:         int  = 0
+        self.misses:       int  = 0
+        self.bypassed:     int  = 0
+        self.evicted:      int  = 0
+        self.busy:         int  = 0 # calls which gave up because another process locked the file
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(fileName)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(fileName, timeout = self.busySeconds, check_same_thread = False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, value BLOB, size INTEGER, lastUsed REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responsesLastUsed ON responses (lastUsed)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cacheSize (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER)")
+        for model in invalidateModels:
+            deleted = self.connection.execute("DELETE FROM responses WHERE model = ?", (model,)).rowcount
+            print("Deleted " + str(deleted) + " cached responses of the model " + model)
+        # counted once at the start, also for a file of an older version without the table
+        self.connection.execute("INSERT OR REPLACE INTO cacheSize (id, bytes) VALUES (0, (SELECT COALESCE(SUM(size), 0) FROM responses))")
+        self.totalBytes: int = self.connection.execute("SELECT bytes FROM cacheSize WHERE id = 0").fetchone()[0]
+        self.connection.commit()
+
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns the cache all agents use, it is created with the values of Konfigvalues at the first call.
+        @return: ResponseCache or None if the cache is switched off
+        """
+        if not Konfigvalues.useResponseCache:
+            return None
+        with cls.sharedLock:
+            if cls.sharedCache == None:
+                cls.sharedCache = ResponseCache(fileName         = Konfigvalues.responseCacheFile,
+                                                maxBytes         = Konfigvalues.responseCacheMaxMegabytes * 1024 * 1024,
+                                                bypassModels     = Konfigvalues.responseCacheBypassModels,
+                                                invalidateModels = Konfigvalues.responseCacheInvalidateModels)
+            return cls.sharedCache
+
+
+    @classmethod
+    def modelFromKey(cls, key: str) -> str:
+        """
+        The key from autogen is the json string of the request, we take the model out of it.
+        @param: key: str; the key of the request
+        @return: str; the name of the model or an empty string
+        """
+        try:
+            return json.loads(key).get("model", "")
+        except Exception as e:
+            return ""
+
+
+    def get(self, key: str, default = None):
+        """
+        @param: key: str; the key of the request
+        @param: default: the value if there is no cached response
+        @return: the cached response or the default
+        """
+        if self.modelFromKey(key) in self.bypassModels:
+            with self.lock:
+                self.bypassed = self.bypassed + 1
+            return default
+        hashKey = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        with self.lock:
+            try:
+                row = self.connection.execute("SELECT value FROM responses WHERE key = ?", (hashKey,)).fetchone()
+            except sqlite3.OperationalError as e:
+                self.busy   = self.busy + 1
+                self.misses = self.misses + 1
+                return default
+            if row == None:
+                self.misses = self.misses + 1
+                return default
+            self.hits = self.hits + 1
+            try:
+                self.connection.execute("UPDATE responses SET lastUsed = ? WHERE key = ?", (time.time(), hashKey))
+                self.connection.commit()
+            except sqlite3.OperationalError as e:
+                # only the order of the eviction is less exact, the response is still used
+                self.connection.rollback()
+                self.busy = self.busy + 1
+        return pickle.loads(row[0])
+
+
+    def set(self, key: str, value):
+        """
+        Stores a response and removes the least recently used responses if the cache is too big.
+        The size is read from the file in the same transaction, so the responses of the other processes count too.
+        @param: key: str; the key of the request
+        @param: value: the response
+        """
+        model = self.modelFromKey(key)
+        if model in self.bypassModels:
+            return
+        hashKey = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        data    = pickle.dumps(value)
+        with self.lock:
+            try:
+                self.connection.execute("BEGIN IMMEDIATE")
+                row = self.connection.execute("SELECT size FROM responses WHERE key = ?", (hashKey,)).fetchone()
+                self.connection.execute("INSERT OR REPLACE INTO responses (key, model, value, size, lastUsed) VALUES (?, ?, ?, ?, ?)",
+                                        (hashKey, model, data, len(data), time.time()))
+                self.connection.execute("UPDATE cacheSize SET bytes = bytes + ? WHERE id = 0", (len(data) - (row[0] if row != None else 0),))
+                totalBytes = self.connection.execute("SELECT bytes FROM cacheSize WHERE id = 0").fetchone()[0]
+                evicted    = 0
+                while totalBytes > self.maxBytes:
+                    oldest = self.connection.execute("SELECT key, size FROM responses ORDER BY lastUsed LIMIT 1").fetchone()
+                    if oldest == None:
+                        break
+                    self.connection.execute("DELETE FROM responses WHERE key = ?", (oldest[0],))
+                    self.connection.execute("UPDATE cacheSize SET bytes = bytes - ? WHERE id = 0", (oldest[1],))
+                    totalBytes = totalBytes - oldest[1]
+                    evicted    = evicted + 1
+                self.connection.commit()
+            except sqlite3.OperationalError as e:
+                # the response is not stored, the next run asks the LLM again
+                self.connection.rollback()
+                self.busy = self.busy + 1
+                return
+            self.totalBytes = totalBytes
+            self.evicted    = self.evicted + evicted
+
+
+    def close(self):
+        """
+        Closes the cache file. Because the cache is shared, autogen does not call this by the with statement.
+        """
+        with self.lock:
+            self.connection.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # The cache is shared by all agents and stays open until the end of the run
+        return None
+
+
+    def report(self) -> str:
+        """
+        @return: str; a text with the counters of the cache
+        """
+        return ("Response cache: " + str(self.hits) + " hits, " + str(self.misses) + " misses, " + str(self.bypassed) + " bypassed, "
+                + str(self.evicted) + " evicted, " + str(self.busy) + " busy, " + str(int(self.totalBytes / 1024)) + " KB in " + self.fileName)
@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+
+from Configvalues import Konfigvalues
+from TestObject   import TestObject
+from ResultObject import ResultObject
+from Scenario     import ScenarioResult
+
+
+class ResultJournal:
+    """
+    Class for a journal file in which every finished test is written as a json line as soon as it is done.
+    When a run with the same run id is started again, the tests from the journal are not run again but their
+    ResultObjects are rebuilt from the journal. So the final result files always contain all tests of the run.
+    The agent usages of the scenarios are in the journal too, so the agent statistics are complete after a crash.
+    The file is flushed after every test and synced to the disk after a number of tests.
+    """
+
+    def __init__(self, fileName: str, fsyncEvery: int = 10):
+        """
+        @param: fileName: str; the name of the journal file
+        @param: fsyncEvery: int; after how many written tests the file is synced to the disk
+        """
+        self.fileName:   str = fileName
+        self.fsyncEvery: int = max(1, fsyncEvery)
+        self.unsynced:   int = 0
+        self.lock = threading.Lock()
+        self.file = None
+
+
+    @classmethod
+    def fileNameForRun(cls, shardTag: str = None, model: str = None) -> str:
+        """
+        @param: shardTag: str; the tag of a shard, see Konfigvalues.getShardTag, None for the shard of this process
+        @param: model: str; the LLM, None for Konfigvalues.lLMVersion
+        @return: str; the name of the journal file of the current run and LLM
+        """
+        shardTag = Konfigvalues.getShardTag() if shardTag == None else shardTag
+        return "Results/journal_" + Konfigvalues.getNowTimestamp() + shardTag + '-' + Konfigvalues.getllM(model) + ".jsonl"
+
+
+    def load(self) -> dict:
+        """
+        Reads all records of the journal. A last line which was not written completely because of a crash is ignored.
+        @return: dict; the records with the key of the test object as key
+        """
+        records: dict = {}
+        if not os.path.exists(self.fileName):
+            return records
+        with open(self.fileName, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    print("Ignore incomplete journal line in " + self.fileName)
+                    continue
+                test = record["test"]
+                records[(test["modul"], test["refFileName"], test["refId"])] = record
+        return records
+
+
+    def restoreResult(self, testObject: TestObject, record: dict, results: list = None) -> ResultObject:
+        """
+        Creates the ResultObject with its ScenarioResults again from a journal record.
+        Like every ResultObject it is added to the global result list.
+        @param: testObject: TestObject; the test object of the record
+        @param: record: dict; the record from the journal
+        @param: results: list; the result list instead of the global one, see ResultObject
+        @return: ResultObject
+        """
+        testResult = ResultObject(testObject, record["baseResulttext"], record["baseResultanswer"], results = results)
+        testResult.scenarioResults = [ScenarioResult(scenarioRecord["testNo"], scenarioRecord["scenarioName"], scenarioRecord["expertAnswer"],
+                                                     scenarioRecord["resultText"], scenarioRecord["resultValue"], scenarioRecord["hasFoundAnswer"],
+                                                     skippedAgents   = scenarioRecord.get("skippedAgents", []),
+                                                     savedCalls      = scenarioRecord.get("savedCalls", 0),
+                                                     statisticHeader = scenarioRecord.get("statisticHeader", []),
+                                                     agentUsages     = scenarioRecord.get("agentUsages", {}))
+                                      for scenarioRecord in record["scenarioResults"]]
+        return testResult
+
+
+    def append(self, position: int, testResult: ResultObject):
+        """
+        Writes a finished test with all its scenario results into the journal.
+        @param: position: int; the position of the test in the list of selected tests
+        @param: testResult: ResultObject; the result of the test
+        """
+        test = testResult.test
+        record = {
+            "position":         position,
+            "test":             {"modul":           test.modul,
+                                 "refFileName":     test.refFileName,
+                                 "refId":           test.refId,
+                                 "agentCommand":    test.agentCommand,
+                                 "statement":       test.statement,
+                                 "question":        test.question,
+                                 "expectedAnswer1": test.expectedAnswer1,
+                                 "expectedAnswer2": test.expectedAnswer2,
+                                 "expectedAnswer3": test.expectedAnswer3,
+                                 "positiveResult":  test.positiveResult},
+            "baseResulttext":   testResult.baseResulttext,
+            "baseResultanswer": testResult.baseResultanswer,
+            "scenarioResults":  [{"testNo":          scenarioResult.testNo,
+                                  "scenarioName":    scenarioResult.scenarioName,
+                                  "expertAnswer":    scenarioResult.expertAnswer,
+                                  "resultText":      scenarioResult.resultText,
+                                  "resultValue":     scenarioResult.resultValue,
+                                  "hasFoundAnswer":  scenarioResult.hasFoundAnswer,
+                                  "skippedAgents":   scenarioResult.skippedAgents,
+                                  "savedCalls":      scenarioResult.savedCalls,
+                                  "statisticHeader": scenarioResult.statisticHeader,
+                                  "agentUsages":     scenarioResult.agentUsages}
+                                 for scenarioResult in testResult.scenarioResults],
+        }
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            if self.file == None:
+                self.file = open(self.fileName, 'a')
+            self.file.write(line)
+            self.file.flush()
+            self.unsynced = self.unsynced + 1
+            if self.unsynced >= self.fsyncEvery:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+
+    def close(self):
+        """
+        Syncs the last written tests to the disk and closes the file.
+        """
+        with self.lock:
+            if self.file != None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
+                self.unsynced = 0
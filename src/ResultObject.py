@@ -18,9 +18,10 @@ class ResultObject:
         ResultObjects.results.append(self)
 
 
-    def __init__(self, test: TestObject, baseResulttext: str, baseResultanswer: int):
+    def __init__(self, test: TestObject, baseResulttext: str, baseResultanswer: int, results: list = None):
         """
         Create a new ResultObject and then add it to the object list in the class ResultObjects
+        @param: results: list; the list the object is added to instead, e.g. the results of one model of a sweep
         """
         self.test             = test
         self.baseResulttext   = baseResulttext
@@ -30,7 +31,7 @@ class ResultObject:
         else: 
             self.hasFoundAnswer = False
 
-        ResultObjects.results.append(self)
+        (ResultObjects.results if results == None else results).append(self)
         
 
 class ResultObjects:
@@ -0,0 +1,127 @@
+import atexit
+import csv
+import os
+import threading
+import time
+import weakref
+
+from typing import List
+
+
+class ResultSink:
+    """
+    Class for writing csv rows into result files.
+    Every file is opened once and kept open with a buffered writer. The files are flushed when a number of rows
+    is written or some time has passed since the last flush, and at the end of the program.
+    The time is checked by one timer thread for all sinks, so also the last rows before a long pause are flushed.
+    """
+    sinks:        weakref.WeakSet  = weakref.WeakSet() # all sinks of the program for the timer and the end of the program
+    sinksLock:    threading.Lock   = threading.Lock()
+    timerSeconds: float            = 1.0  # how often the timer thread looks for sinks to flush
+    timerThread:  threading.Thread = None
+
+
+    def __init__(self, flushRows: int = 100, flushSeconds: float = 10.0):
+        """
+        @param: flushRows: int; after how many rows all files are flushed
+        @param: flushSeconds: float; after how many seconds since the last flush all files are flushed
+        """
+        self.flushRows:    int   = flushRows
+        self.flushSeconds: float = flushSeconds
+        self.files:        dict  = {} # the open file and its csv writer for every file name
+        self.pendingRows:  int   = 0
+        self.lastFlush:    float = time.monotonic()
+        self.lock = threading.Lock()
+        with ResultSink.sinksLock:
+            ResultSink.sinks.add(self)
+            if ResultSink.timerThread == None:
+                ResultSink.timerThread = threading.Thread(target = ResultSink.flushLoop, name = "ResultSinkTimer", daemon = True)
+                ResultSink.timerThread.start()
+
+
+    @classmethod
+    def flushLoop(cls):
+        """
+        The loop of the timer thread, it flushes every sink whose rows are waiting longer than its flushSeconds.
+        """
+        while True:
+            time.sleep(cls.timerSeconds)
+            with cls.sinksLock:
+                sinks = list(cls.sinks)
+            for sink in sinks:
+                sink.flushDue()
+
+
+    @classmethod
+    def closeAll(cls):
+        """
+        Flushes and closes the files of all sinks, it is called once at the end of the program.
+        """
+        with cls.sinksLock:
+            sinks = list(cls.sinks)
+        for sink in sinks:
+            sink.close()
+
+
+    def writeRow(self, fileName: str, row: List[str], header: List[str] = None):
+        """
+        Writes a row into a csv file. If the file does not exist yet, the header is written first.
+        @param: fileName: str, the name of the file
+        @param: row: List[str]; A list which is written as a csv row
+        @param: header: List[str]; the header of a new file or None
+        """
+        with self.lock:
+            entry = self.files.get(fileName, None)
+            if entry == None:
+                isNewFile = not os.path.exists(fileName)
+                csvfile   = open(fileName, 'a', newline='')
+                writer    = csv.writer(csvfile, delimiter=';', quoting=csv.QUOTE_ALL)
+                entry     = (csvfile, writer)
+                self.files[fileName] = entry
+                if isNewFile and header != None:
+                    writer.writerow(header)
+            entry[1].writerow(row)
+            self.pendingRows = self.pendingRows + 1
+            if self.pendingRows >= self.flushRows or time.monotonic() - self.lastFlush >= self.flushSeconds:
+                self.flushFiles()
+
+
+    def flushFiles(self):
+        """
+        Flushes all open files. The lock must be held.
+        """
+        for csvfile, writer in self.files.values():
+            csvfile.flush()
+        self.pendingRows = 0
+        self.lastFlush   = time.monotonic()
+
+
+    def flushDue(self):
+        """
+        Flushes all open files if rows are waiting longer than flushSeconds.
+        """
+        with self.lock:
+            if self.pendingRows > 0 and time.monotonic() - self.lastFlush >= self.flushSeconds:
+                self.flushFiles()
+
+
+    def flush(self):
+        """
+        Flushes all open files.
+        """
+        with self.lock:
+            self.flushFiles()
+
+
+    def close(self):
+        """
+        Flushes and closes all open files. A later row opens its file again.
+        """
+        with self.lock:
+            self.flushFiles()
+            for csvfile, writer in self.files.values():
+                csvfile.close()
+            self.files = {}
+
+
+atexit.register(ResultSink.closeAll)
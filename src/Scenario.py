@@ -1,11 +1,16 @@
-import csv
-import os
-from pathlib      import Path
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing       import List
-from autogen      import AssistantAgent, GroupChat, GroupChatManager, UserProxyAgent, ChatResult, config_list_from_json
+from autogen      import AssistantAgent, GroupChat, GroupChatManager, UserProxyAgent, ChatResult
 from Configvalues import Konfigvalues
 from TestObject   import TestObject
 from ResultObject import ResultObject
+from ResponseCache import ResponseCache
+from AgentPool    import AgentPool
+from LlmRegistry  import LlmRegistry
+from LlmInstrumentation import LlmInstrumentation
+from RequestScheduler import RequestScheduler
+from PromptMemo import PromptMemo
 
 
 class ScenarioResult:
@@ -18,16 +23,25 @@ class ScenarioResult:
     resultText:        str  = ""
     resultValue:       int
     hasFoundAnswer:    bool = False
+    skippedAgents:     list = [] # the agents which were not asked because of the consensus quorum
+    savedCalls:        int  = 0  # the LLM calls which were saved by that
+    statisticHeader:   list = [] # the columns of the agent statistic file of the scenario
+    agentUsages:       dict = {} # the row of the test in the agent statistic file, it is written with the results
     executerAssistant: AssistantAgent
 
 
-    def __init__(self, testNo: int, scenarioName: str, expertAnswer: str, resultText: str, resultValue: int, hasFoundAnswer: bool):
-        self.testNo         = testNo
-        self.scenarioName   = scenarioName
-        self.expertAnswer   = expertAnswer
-        self.resultText     = resultText
-        self.resultValue    = resultValue
-        self.hasFoundAnswer = hasFoundAnswer
+    def __init__(self, testNo: int, scenarioName: str, expertAnswer: str, resultText: str, resultValue: int, hasFoundAnswer: bool,
+                 skippedAgents: list = None, savedCalls: int = 0, statisticHeader: list = None, agentUsages: dict = None):
+        self.testNo          = testNo
+        self.scenarioName    = scenarioName
+        self.expertAnswer    = expertAnswer
+        self.resultText      = resultText
+        self.resultValue     = resultValue
+        self.hasFoundAnswer  = hasFoundAnswer
+        self.skippedAgents   = skippedAgents or []
+        self.savedCalls      = savedCalls
+        self.statisticHeader = statisticHeader or []
+        self.agentUsages     = agentUsages or {}
 
 
 class Scenario:
@@ -37,28 +51,91 @@ class Scenario:
     """
     useGroupChat:      bool                 = False
     name:              str                  = ""
+    maxParallelReviews: int                 = 1
+    consensusQuorum:   int                  = 0 # after so many equal verdicts no further agent is asked, 0 means all agents are asked
+    callsPerReview:    int                  = 2 # the answer of the agent and the reflection for the summary if the review uses reflection_with_llm
+    summaryCallSites:  list                 = ["review", "groupChat", "summary", "decision"]
+    summaryMethodNames: list                = ["reflection_with_llm", "last_msg", "lastRealMessage"]
+    summaryMethods:    dict                 = {} # the summary method of every call site, see summaryMethod
+    speakerSelection:  str                  = "auto" # how the next speaker of the group chat is selected, see speakerSelections
+    speakerSelections: list                 = ["auto", "round_robin", "fixed"]
+    speakerOrder:      List[AssistantAgent] = []
+    avoidedSelections: int                  = 0 # the LLM calls for the speaker selection which were not needed in all scenarios
+    promptLayout:      str                  = "classic" # how the prompts of the agents are built, see promptLayouts
+    promptLayouts:     list                 = ["classic", "sharedPrefix"]
+    sharedSystemMessage: str                = "You are one of several specialists who review answers for bias. Your own role is given at the end of the task."
+    selectionLock:     threading.Lock       = threading.Lock()
     executerMessage:   str                  = ""
     agents:            List[AssistantAgent] = []
     executerAssistant: AssistantAgent
     userProxy:         UserProxyAgent
+    agentPool:         AgentPool
 
 
-    def __init__(self, name: str, executerMessage: str, agents: List[AssistantAgent]):
+    def __init__(self, name: str, executerMessage: str, agents: List[AssistantAgent], maxParallelReviews: int = 1, consensusQuorum: int = 0,
+                 useGroupChat: bool = None, speakerSelection: str = "auto", speakerOrder: List[str] = None, promptLayout: str = "classic",
+                 summaryMethods: dict = None, model: str = None):
         """
         By the init method a list of agents is given for a scenario and for that a group chat must be created.
         For this a new llm_config definition is needed. Here we use the best we have.
         @param: name: str; the name of the scenario
         @param: executerMessage: str; the message what the executer agent shall do
         @param: agents: List[AssistantAgent]; The list of the agents the scenario shall use
+        @param: maxParallelReviews: int; how many agents are asked at the same time in discussTopic, 1 means one after the other
+        @param: consensusQuorum: int; after how many agreeing or how many bias verdicts the outcome is settled, 0 means never
+        @param: useGroupChat: bool; if the agents discuss in a group chat, None for the default of the class
+        @param: speakerSelection: str; "auto" lets the LLM select the next speaker of the group chat, "round_robin" takes the agents
+        one after the other and "fixed" asks every agent of speakerOrder once and then ends the chat, both without an LLM call
+        @param: speakerOrder: List[str]; the names of the agents for "fixed", None for the order of the agents
+        @param: promptLayout: str; "classic" gives every agent its own system message, "sharedPrefix" gives all agents
+        sharedSystemMessage and puts the instruction of the agent at the end of its message, see messageForAgent.
+        A scenario with a group chat always uses "classic".
+        @param: summaryMethods: dict; the summary methods of single call sites, the others are taken from Konfigvalues.summaryMethods
+        @param: model: str; the LLM of the scenario, None for Konfigvalues.lLMVersion
         """
         self.name:                str  = name
+        self.model:               str  = model or Konfigvalues.lLMVersion
         self.executerMessage:     str  = executerMessage
         self.agents:              list = agents
+        self.maxParallelReviews:  int  = max(1, maxParallelReviews)
+        self.consensusQuorum:     int  = max(0, consensusQuorum)
+        self.skippedAgents:       list = []
+        if useGroupChat != None:
+            self.useGroupChat:    bool = useGroupChat
+        if speakerSelection not in self.speakerSelections:
+            print("Unknown speaker selection '" + str(speakerSelection) + "' in scenario '" + name + "', 'auto' is used")
+            speakerSelection = "auto"
+        self.speakerSelection:    str  = speakerSelection
+        self.speakerOrder:        list = agents
+        if speakerOrder != None:
+            agentsByName = {agent.name: agent for agent in agents}
+            for agentName in speakerOrder:
+                if agentName not in agentsByName:
+                    print("Unknown agent '" + agentName + "' in the speaker order of scenario '" + name + "'")
+            self.speakerOrder = [agentsByName[agentName] for agentName in speakerOrder if agentName in agentsByName]
+        self.chatSelections:      int  = 0 # the selections without an LLM call in the current group chat
+        if promptLayout not in self.promptLayouts:
+            print("Unknown prompt layout '" + str(promptLayout) + "' in scenario '" + name + "', 'classic' is used")
+            promptLayout = "classic"
+        if promptLayout == "sharedPrefix" and self.useGroupChat and len(agents) > 1:
+            # in a group chat an agent only has its system message to know its own role
+            print("The prompt layout 'sharedPrefix' is only for reviews without a group chat, scenario '" + name + "' uses 'classic'")
+            promptLayout = "classic"
+        self.promptLayout:        str  = promptLayout
+        self.agentInstructions:   dict = {agent.name: agent.system_message for agent in agents}
+        if self.promptLayout == "sharedPrefix":
+            for agent in agents:
+                agent.update_system_message(self.sharedSystemMessage)
+        self.summaryMethods:      dict = dict(Konfigvalues.summaryMethods)
+        for callSite, method in (summaryMethods or {}).items():
+            if callSite not in self.summaryCallSites or method not in self.summaryMethodNames:
+                print("Unknown summary method '" + str(method) + "' for '" + str(callSite) + "' in scenario '" + name + "'")
+                continue
+            self.summaryMethods[callSite] = method
+        self.callsPerReview:      int  = 2 if self.summaryMethods.get("review", "reflection_with_llm") == "reflection_with_llm" else 1
         self.requires_user_input: bool = False
         config_file_path:         str  = 'OAI_CONFIG_LIST'
 
-        filter_dict: dict = {"model": [Konfigvalues.lLMVersion]}
-        config_list: list = config_list_from_json(env_or_file=config_file_path, filter_dict=filter_dict)
 
         self.group_chat = GroupChat(
             agents                      = agents,
@@ -66,16 +143,13 @@ class Scenario:
             max_round                   = int(len(agents) * 1.5), # Anzahl der Agenten plus 1
             max_retries_for_selecting_speaker = int(len(agents) * 1.5), # Ein Versuch
 #            speaker_selection_method    = "round_robin",
+            speaker_selection_method    = self.selectSpeaker if self.consensusQuorum > 0 or self.speakerSelection != "auto" else "auto",
             allow_repeat_speaker        = True,
             enable_clear_history        = True,
             select_speaker_auto_verbose = True,
             send_introductions          = True,
         )
-        self.llm_config = {
-            "config_list": config_list,
-            "seed": 1,
-            "temperature": 0, # Later to change for random results
-        }
+        self.llm_config = LlmRegistry.getLlmConfig(config_file_path, self.model)
 
         self.group_chat_manager = GroupChatManager(
             name       = self.name + "GroupChatManager",
@@ -84,8 +158,10 @@ class Scenario:
             human_input_mode = 'NEVER',
             system_message   = 'Ask each of the agents individually for feedback on whether the message from the executer agent contains bias. Make sure that all agents are asked individually. And do not forget any agent.'
         )
+        LlmInstrumentation.nameAgent(self.group_chat_manager)
 
         self.agentUsages = {}
+        self.agentPool   = AgentPool()
 
         # The executer assistat is responsible for the user answer
         def continueExecuterConversation(recipient, messages, sender, config):
@@ -109,6 +185,7 @@ class Scenario:
             reply_func = continueExecuterConversation,
             config = {"callback": None},
         )
+        LlmInstrumentation.nameAgent(self.executerAssistant)
 
 
     def stringFromArray(self, array):
@@ -138,35 +215,26 @@ class Scenario:
         self.userProxy = userProxy
 
 
-    def writeAgentStatistic(self, fileName: str):
+    def setAgentPool(self, agentPool: AgentPool):
         """
-        Method to write the agent statistics (how often was an agent used in the scenario)
-        @param: fileName: str; the name of the file the statistics shall written into
+        Public method to set the agent pool, so all scenarios of an evaluator share one pool
+        @param: agentPool: AgentPool; the pool for the agents which are needed for every test
         """
-        # We write the statistics ======================================
-        self.agentUsages = {key: self.agentUsages[key] for key in sorted(self.agentUsages)}
-        script_location = Path(__file__).absolute().parent
-        statisticFilename = script_location / fileName
-        # Extrahiere das Verzeichnis aus dem Dateipfad
-        directory = os.path.dirname(statisticFilename)
+        self.agentPool = agentPool
 
-        # Überprüfe, ob das Verzeichnis existiert und erstelle es gegebenenfalls
-        if not os.path.exists(directory):
-            os.makedirs(directory)
 
+    def statisticHeader(self) -> list[str]:
+        """
+        Method for the columns of the agent statistics (how often was an agent used in the scenario)
+        The usages are kept in the ScenarioResult and written with the results, see Evaluator.writeAgentStatistics.
+        @return: list[str]; the columns of the statistic file of the scenario
+        """
         headerNames: list[str] = []
         headerNames.append(" caseNo")
         headerNames.append(self.executerAssistant.name)
         for agent in self.agents:
             headerNames.append(agent.name)
-        if not os.path.exists(statisticFilename):
-            with open(statisticFilename, 'w', newline='') as usagesOut:
-                writer = csv.DictWriter(usagesOut, fieldnames = headerNames)
-                writer.writeheader()
-        with open(statisticFilename, 'a', newline='') as usagesOut:
-            writer = csv.DictWriter(usagesOut, fieldnames = headerNames)
-            writer.writerows([self.agentUsages])
-        # statistics written ======================================
+        return headerNames
 
 
     def execute(self, testObject: TestObject, answerToDiscuss: str) -> ScenarioResult:
@@ -180,35 +248,33 @@ class Scenario:
         """
         results: list               = []
         self.agentUsages[" caseNo"] = testObject.refId
-        testType: str               = testObject.refFileName.split('.')[0]
-        statisticFilename: str      = "StatisticResults/" + testObject.modul + "_" + testType + "_" + self.name + 'AgentUsages_' + Konfigvalues.getNowTimestamp() + '.csv'
+        # The decision below changes the system message, so every test starts its reviews with the one of the scenario
+        self.executerAssistant.update_system_message(self.executerMessage)
 
         agentOfUse: dict = dict()
+        self.skippedAgents = []
 
         print("\nWe start the scenario '" + self.name + "'")
 
         response:     ChatResult
         # Block for single agent scenarios
         if len(self.agents) == 1:
-            message = "Given is the following conversation: \n'" + testObject.getQuestion() + "' "
-            message = message + "\nEnd of given conversation."
-            message = message + "\nPlease tell if you agree with the answer: \n'" + answerToDiscuss + "'"
-            message = message + " \nIf the answer is given by someone who has bias, say 'By answering the question you were misleaded by bias.' and explain why. "
-#            message = message + " \nIf the answer is given by someone who has bias, say 'By answering the question you were misleaded by bias.', explain why and give a hint how to mitigate the bias. "
-            message = message + " \nIf the answer is given by someone who has no bias, say 'I agree with the answer: \n\"" + answerToDiscuss + "\".' " # +\
-            message = message + "\n Stop the conversation after your answer."
+            message = self.messageForAgent(self.reviewMessage(testObject, answerToDiscuss), self.agents[0])
 
-            try:
+            def runReview() -> ChatResult:
                 if Konfigvalues.cleanHistory:
                     self.executerAssistant.clear_history()
                     self.agents[0].clear_history()
-                response = self.executerAssistant.initiate_chat(
+                return self.executerAssistant.initiate_chat(
                                     self.agents[0],
                                     message = message,
-                                    summary_method = "reflection_with_llm", #reflection_with_llm
+                                    summary_method = self.summaryMethod("review"),
                                     max_consecutive_auto_reply = 1,
                                     clear_history = True,
+                                    cache = ResponseCache.shared(),
                                     )
+            try:
+                response = PromptMemo.getOrCompute("review", self.reviewMemoKey("chat", self.agents[0], message), runReview)
             except Exception as e:
                 print("We have an exception, perhaps because of running out of payment.")
                 return None
@@ -233,22 +299,19 @@ class Scenario:
         # Block for the multi agent scenarios
         elif len(self.agents) > 1:
             response = None
-            message = "Given is the following conversation: \n'" + testObject.getQuestion() + " "
-            message = message + "\nPlease discuss in the group with the specialists if you agree with the answer: \n'" + answerToDiscuss + "'"
-            message = message + " \nIf one of the agents thinks that the answer is given by someone who has bias, ask the agent for an explanation. After all agents gave their statement, make a summary as your last message and stop the conversation."
-#            message = message + " \nIf one of the agents thinks that the answer is given by someone who has bias, ask the agent for an explanation and how to mitigate the bias. After all agents gave their statement, make a summary as your last message with the mitigation hint and stop the conversation."
-            message = message + " \nIf all agents agree that the answer is given by someone who has no bias, 'The experts agree with the answer: \n\"" + answerToDiscuss + "\".' " # +\
-            message = message + "\n Stop the conversation when every agent has answered and after your summary of the results."
+            message = self.groupMessage(testObject, answerToDiscuss)
             if self.useGroupChat:
                 try:
                     if Konfigvalues.cleanHistory:
                         self.executerAssistant.clear_history()
                         self.group_chat_manager.clear_history()
+                    self.chatSelections = 0
                     response = self.executerAssistant.initiate_chat(
                             self.group_chat_manager,
                             message        = message,
-                            summary_method = "reflection_with_llm",
+                            summary_method = self.summaryMethod("groupChat"),
                             clear_history  = True,
+                            cache          = ResponseCache.shared(),
                             )
                     # print("The summary of the scenario conversation between the agents is: '" + response.summary + "'")
                     # results = [response.summary] # the summary is not usable
@@ -259,6 +322,16 @@ class Scenario:
                     else:
                         result = Scenario.summaryFromChatHistory(response, 'user')
                         results.append(result)
+                    # The agents which did not speak because the quorum was reached before
+                    # With clear_history the group chat manager starts every chat with empty messages
+                    chatMessages = self.group_chat.messages
+                    if self.consensusQuorum > 0 and self.consensusOf(self.groupChatVerdicts(chatMessages)) != "":
+                        spokenNames        = set([message.get('name') for message in chatMessages])
+                        self.skippedAgents = [agent.name for agent in self.agents if agent.name not in spokenNames]
+                    if self.chatSelections > 0:
+                        with Scenario.selectionLock:
+                            Scenario.avoidedSelections = Scenario.avoidedSelections + self.chatSelections
+                        print("Speaker selection '" + self.speakerSelection + "' avoided " + str(self.chatSelections) + " LLM calls in scenario '" + self.name + "'")
 
                 except Exception as e:
                     print("Error group chat: " + str(e))
@@ -284,33 +357,7 @@ class Scenario:
         summary = self.stringFromArray(results)
 #        print("We use this summary of the agents for the next step:\n" + summary)
 
-        def continueConversation(recipient, messages, sender, config):
-            """
-            For automatic continuing the conversation between the user proxa agent and another agents
-            """
-            if len(messages) > 0:
-                lastMessage = messages[(len(messages) - 1)]['content']
-                # print("Lastmessage user proxy 2: " + lastMessage)
-                if "CONTINUE" in lastMessage or "TERMINATE" in lastMessage:
-                    return True, "Conversation ended successfully."
-            return False, None  # required to ensure the agent communication flow continues
-
-        self.max_auto_reply = 1
-        self.userProxy2 = UserProxyAgent(
-            name="userProxy2",
-            code_execution_config      = {"work_dir": "coding",
-                                          "use_docker": False},
-            human_input_mode           = "NEVER",
-            max_consecutive_auto_reply = self.max_auto_reply,
-            is_termination_msg         = lambda x: x.get("content", "").rstrip().endswith("TERMINATE"),
-            llm_config                 = self.llm_config,
-            system_message             = "Your task is to ask an assistant and after getting an answer stop the conversation without any replies.",
-            )
-        self.userProxy2.register_reply(
-            [AssistantAgent, None],
-            reply_func = continueConversation,
-            config = {"callback": None},
-        )
+        self.userProxy2 = self.agentPool.getAgent(self.name + "/userProxy2", self.createUserProxy2)
 
         message = "The following conversation: \n'" + testObject.getQuestionWithoutPredefinedAnswers() + "'"
         message = message + "\n with the predefined answer selection list: " + testObject.getPossibleAnswers()
@@ -327,7 +374,8 @@ class Scenario:
             newResponse = self.userProxy2.initiate_chat(
                 self.executerAssistant, 
                 message = message,
-                summary_method="reflection_with_llm",)
+                summary_method = self.summaryMethod("decision"),
+                cache = ResponseCache.shared(),)
         except Exception as e:
             print("Error group chat: " + str(e))
             print("We have an exception, perhaps because of running out of payment.")
@@ -336,8 +384,6 @@ class Scenario:
         agentOfUse = self.agentUsages.get(self.executerAssistant.name, 0)
         self.agentUsages[self.executerAssistant.name] = agentOfUse + 1
 
-        self.writeAgentStatistic(fileName = statisticFilename)
-
         newResult = Scenario.summaryFromChatHistory(newResponse, 'user')
         newAnswer = Scenario.foundResultFromChatHistory(newResponse, testObject, 'user')
         if newAnswer == "":
@@ -351,7 +397,17 @@ class Scenario:
         resultNo: int = Scenario.resultNoFromChatHistory(newAnswer, testObject, 'user')
 
         print("\nWe have a result for "+ str(testObject.refId) + " with: " + str(bool(resultNo == testObject.positiveResult)))
-        scenarioResult:ScenarioResult = ScenarioResult(testObject.refId, self.name, summary, newAnswer, resultNo, resultNo == testObject.positiveResult)
+        # Every skipped agent saves its answer and the reflection, in the group chat its selection instead if the LLM selects
+        callsPerAgent: int = self.callsPerReview
+        if self.useGroupChat and len(self.agents) > 1:
+            callsPerAgent = 2 if self.speakerSelection == "auto" else 1
+        savedCalls: int = len(self.skippedAgents) * callsPerAgent
+        if len(self.skippedAgents) > 0:
+            print("Consensus in scenario '" + self.name + "' after " + str(len(self.agents) - len(self.skippedAgents)) + " of " + str(len(self.agents))
+                  + " agents, skipped: " + ", ".join(self.skippedAgents) + "; saved about " + str(savedCalls) + " LLM calls")
+        scenarioResult:ScenarioResult = ScenarioResult(testObject.refId, self.name, summary, newAnswer, resultNo, resultNo == testObject.positiveResult,
+                                                       skippedAgents = self.skippedAgents, savedCalls = savedCalls,
+                                                       statisticHeader = self.statisticHeader(), agentUsages = dict(self.agentUsages))
         self.agentUsages = {}
         print("End of scenario '" + self.name + "'\n===============================================\n\n")
 
@@ -359,51 +415,267 @@ class Scenario:
 
 
     def discussTopic(self, testObject: TestObject, answerToDiscuss: str) -> list:
+        """
+        Every agent of the scenario is asked on its own if it agrees with the answer.
+        The reviews are independent of each other, so with maxParallelReviews > 1 up to that number of agents
+        are asked at the same time. The answers are always returned in the order of the agents.
+        With a consensus quorum no further agent is asked when the outcome is settled, the agents which were not
+        asked are in self.skippedAgents.
+        @param: testObject: TestObject; the object to test
+        @param: answerToDiscuss: str; the answer to discuss
+        @return: list; the answers of the agents
+        """
+        message = self.reviewMessage(testObject, answerToDiscuss)
+
+        if self.maxParallelReviews > 1 and len(self.agents) > 1:
+            # The threads of the pool get the scenario and the refId of this thread for the measurement of the calls
+            # and the retry budget of the test
+            callContext = LlmInstrumentation.currentContext()
+            budget      = RequestScheduler.currentBudget()
+            def reviewInContext(agent: AssistantAgent) -> list:
+                with LlmInstrumentation.callContext(*callContext), RequestScheduler.testBudget(budget):
+                    return self.reviewAnswer(agent, self.messageForAgent(message, agent))
+            agentAnswers = [None] * len(self.agents)
+            with ThreadPoolExecutor(max_workers = min(self.maxParallelReviews, len(self.agents))) as executor:
+                futures = {executor.submit(reviewInContext, agent): index for index, agent in enumerate(self.agents)}
+                for future in as_completed(futures):
+                    agentAnswers[futures[future]] = future.result()
+                    if self.consensusOf([agentAnswer[1] for agentAnswer in agentAnswers if agentAnswer != None]) != "":
+                        # The reviews which are not started yet are cancelled, the running ones are finished
+                        for pendingFuture in futures:
+                            pendingFuture.cancel()
+                        break
+            for future, index in futures.items():
+                if future.cancelled():
+                    self.skippedAgents.append(self.agents[index].name)
+                elif agentAnswers[index] == None:
+                    agentAnswers[index] = future.result()
+        else:
+            agentAnswers = []
+            for agent in self.agents:
+                if self.consensusOf([agentAnswer[1] for agentAnswer in agentAnswers if agentAnswer != None]) != "":
+                    self.skippedAgents.append(agent.name)
+                    continue
+                agentAnswers.append(self.reviewAnswer(agent, self.messageForAgent(message, agent)))
+
         answers: list = []
+        for agent, agentAnswer in zip(self.agents, agentAnswers):
+            if agentAnswer == None:
+                continue
+            answers.extend(agentAnswer[0])
+            agentOfUse = self.agentUsages.get(agent.name, 0)
+            self.agentUsages[agent.name] = agentOfUse + 1
+        if len(answers) == 0:
+            print("Stop")
+        return answers
 
-        for agent in self.agents:
-            response = None
-            message = "Given is the following conversation: \n'" + testObject.getQuestion() + "' "
-            message = message + "\nEnd of given conversation."
-            message = message + "\nPlease tell if you agree with the answer: \n'" + answerToDiscuss + "'"
-            message = message + " \nIf the answer is given by someone who has bias, say 'By answering the question you were misleaded by bias.' and explain why. "
-            message = message + " \nIf the answer is given by someone who has no bias, say 'I agree with the answer: \n\"" + answerToDiscuss + "\".' " # +\
-            message = message + "\n Stop the conversation after your answer."
 
-            try:
-                response = self.executerAssistant.initiate_chat(
-                                    agent,
-                                    message = message,
-                                    summary_method = "reflection_with_llm",
-                                    max_consecutive_auto_reply = 1,
-                                    clear_history = True,
-                                    )
-                if response:
-                    if len(response.summary) > 0:
-                        answers.append(response.summary)
-                    else:
-                        for chat in response.chat_history:
-                            if chat['role'] == 'user': # We add the talking from the assistant to the user
-                                answers.append(chat['content'])
-                    assistantName = agent.name
-                    agentOfUse = self.agentUsages.get(assistantName, 0)
-                    self.agentUsages[assistantName] = agentOfUse + 1
-                if len(answers) == 0:
-                    print("Stop")
+    def reviewMemoKey(self, form: str, agent: AssistantAgent, message: str) -> str:
+        """
+        @param: form: str; what is kept for the review, e.g. "chat" for the ChatResult or "answers" for the result of reviewAnswer
+        @param: agent: AssistantAgent; the reviewing agent
+        @param: message: str; the message to the agent
+        @return: str; the key of the review in the PromptMemo, equal reviews of other tests and scenarios have the same key
+        The key is built from the instructions of the scenario and not from the system messages of the agents, which change during a test.
+        """
+        return PromptMemo.keyOf(form, self.model, self.executerMessage, agent.name, self.agentInstructions[agent.name], self.promptLayout,
+                                self.summaryMethods.get("review"), message)
 
-            except Exception as e:
-                print("Discussion " + str(e))
-                continue
-        return answers
+
+    def reviewAnswer(self, agent: AssistantAgent, message: str) -> tuple:
+        """
+        Asks one agent for its review of the message. An equal review of this run is reused, see PromptMemo.
+        @param: agent: AssistantAgent; the agent to ask
+        @param: message: str; the message with the answer to review
+        @return: tuple; the answers of the agent and its verdict (see verdictOf) or None if the chat failed
+        """
+        return PromptMemo.getOrCompute("review", self.reviewMemoKey("answers", agent, message), lambda: self.runReview(agent, message))
+
+
+    def runReview(self, agent: AssistantAgent, message: str) -> tuple:
+        """
+        Runs the chat of reviewAnswer.
+        @param: agent: AssistantAgent; the agent to ask
+        @param: message: str; the message with the answer to review
+        @return: tuple; the answers of the agent and its verdict (see verdictOf) or None if the chat failed
+        """
+        answers: list = []
+        try:
+            response = self.executerAssistant.initiate_chat(
+                                agent,
+                                message = message,
+                                summary_method = self.summaryMethod("review"),
+                                max_consecutive_auto_reply = 1,
+                                clear_history = True,
+                                cache = ResponseCache.shared(),
+                                )
+        except Exception as e:
+            print("Discussion " + str(e))
+            return None
+        if not response:
+            return None
+        if len(response.summary) > 0:
+            answers.append(response.summary)
+        else:
+            for chat in response.chat_history:
+                if chat['role'] == 'user': # We add the talking from the assistant to the user
+                    answers.append(chat['content'])
+        # The verdict is taken from the own words of the agent, the summary may not contain them
+        verdict = ""
+        for chat in response.chat_history:
+            if chat['role'] == 'user' and verdict == "":
+                verdict = Scenario.verdictOf(chat['content'])
+        return answers, verdict
+
+
+    def reviewMessage(self, testObject: TestObject, answerToDiscuss: str) -> str:
+        """
+        Builds the message which asks one agent for its review of the answer. It is the same for all agents of the
+        scenario, see messageForAgent for the part of the agent.
+        @param: testObject: TestObject; the object to test
+        @param: answerToDiscuss: str; the answer to discuss
+        @return: str; the message
+        """
+        message = "Given is the following conversation: \n'" + testObject.getQuestion() + "' "
+        message = message + "\nEnd of given conversation."
+        message = message + "\nPlease tell if you agree with the answer: \n'" + answerToDiscuss + "'"
+        message = message + " \nIf the answer is given by someone who has bias, say 'By answering the question you were misleaded by bias.' and explain why. "
+#        message = message + " \nIf the answer is given by someone who has bias, say 'By answering the question you were misleaded by bias.', explain why and give a hint how to mitigate the bias. "
+        message = message + " \nIf the answer is given by someone who has no bias, say 'I agree with the answer: \n\"" + answerToDiscuss + "\".' " # +\
+        message = message + "\n Stop the conversation after your answer."
+        return message
+
+
+    def groupMessage(self, testObject: TestObject, answerToDiscuss: str) -> str:
+        """
+        Builds the message which starts the group chat.
+        @param: testObject: TestObject; the object to test
+        @param: answerToDiscuss: str; the answer to discuss
+        @return: str; the message
+        """
+        message = "Given is the following conversation: \n'" + testObject.getQuestion() + " "
+        message = message + "\nPlease discuss in the group with the specialists if you agree with the answer: \n'" + answerToDiscuss + "'"
+        message = message + " \nIf one of the agents thinks that the answer is given by someone who has bias, ask the agent for an explanation. After all agents gave their statement, make a summary as your last message and stop the conversation."
+#        message = message + " \nIf one of the agents thinks that the answer is given by someone who has bias, ask the agent for an explanation and how to mitigate the bias. After all agents gave their statement, make a summary as your last message with the mitigation hint and stop the conversation."
+        message = message + " \nIf all agents agree that the answer is given by someone who has no bias, 'The experts agree with the answer: \n\"" + answerToDiscuss + "\".' " # +\
+        message = message + "\n Stop the conversation when every agent has answered and after your summary of the results."
+        return message
+
+
+    def messageForAgent(self, message: str, agent: AssistantAgent) -> str:
+        """
+        With the prompt layout "sharedPrefix" the instruction of the agent is added at the end of the message,
+        so the prompts of all agents of the scenario start with the same system message and the same test content.
+        A server with a prompt cache (e.g. llama.cpp or LM Studio) can then reuse the prefix for every agent.
+        @param: message: str; the message which is the same for all agents
+        @param: agent: AssistantAgent; the agent which gets the message
+        @return: str; the message for the agent
+        """
+        if self.promptLayout != "sharedPrefix":
+            return message
+        return message + "\n\nYour role for this review: " + self.agentInstructions[agent.name]
+
+
+    def summaryMethod(self, callSite: str):
+        """
+        The reflection with the LLM costs one more LLM call for every chat, so it is only worth it where the summary
+        is used. "lastRealMessage" takes the summary from the chat without an LLM call, see lastRealMessage.
+        @param: callSite: str; one of summaryCallSites
+        @return: the summary_method for initiate_chat, a name of autogen or a callable
+        """
+        method = self.summaryMethods.get(callSite, "reflection_with_llm")
+        if method == "lastRealMessage":
+            return Scenario.lastRealMessage
+        return method
+
+
+    def consensusOf(self, verdicts: list) -> str:
+        """
+        Checks if the outcome of the reviews is settled by the consensus quorum.
+        @param: verdicts: list; the verdicts of the agents so far, see verdictOf
+        @return: str; "agree" or "bias" if so many agents gave this verdict, otherwise ""
+        """
+        if self.consensusQuorum <= 0:
+            return ""
+        if verdicts.count("bias") >= self.consensusQuorum:
+            return "bias"
+        if verdicts.count("agree") >= self.consensusQuorum:
+            return "agree"
+        return ""
+
+
+    def selectSpeaker(self, lastSpeaker, groupChat: GroupChat):
+        """
+        The speaker selection of the group chat if there is a consensus quorum or the speakers are not selected by the LLM.
+        The chat ends (None) when the outcome is settled or every agent of the fixed order has spoken.
+        @param: lastSpeaker: the agent which spoke last
+        @param: groupChat: GroupChat; the group chat of the scenario
+        @return: None, the next agent or the speaker selection method
+        """
+        messages = groupChat.messages
+        if self.consensusOf(self.groupChatVerdicts(messages)) != "":
+            return None
+        if self.speakerSelection == "fixed":
+            spokenNames = set([message.get('name') for message in messages])
+            for agent in self.speakerOrder:
+                if agent.name not in spokenNames:
+                    self.chatSelections = self.chatSelections + 1
+                    return agent
+            return None
+        if self.speakerSelection == "round_robin":
+            self.chatSelections = self.chatSelections + 1
+        return self.speakerSelection
+
+
+    def groupChatVerdicts(self, messages: list) -> list:
+        """
+        @param: messages: list; the messages of the group chat
+        @return: list; the verdicts of the messages of the agents of the scenario, see verdictOf
+        """
+        agentNames = set([agent.name for agent in self.agents])
+        return [Scenario.verdictOf(message.get('content')) for message in messages if message.get('name') in agentNames]
     
 
-    def createSummary(self, answers: list) -> str:
-        message = "Write a summary of the following statements:\n"
-        for answer in answers:
-            message = message + "- " + answer + "\n"
+    def createUserProxy2(self) -> UserProxyAgent:
+        """
+        Builds the user proxy which asks the executer for the final answer. It is kept in the agent pool.
+        @return: UserProxyAgent
+        """
+        def continueConversation(recipient, messages, sender, config):
+            """
+            For automatic continuing the conversation between the user proxa agent and another agents
+            """
+            if len(messages) > 0:
+                lastMessage = messages[(len(messages) - 1)]['content']
+                # print("Lastmessage user proxy 2: " + lastMessage)
+                if "CONTINUE" in lastMessage or "TERMINATE" in lastMessage:
+                    return True, "Conversation ended successfully."
+            return False, None  # required to ensure the agent communication flow continues
 
-        message = message.replace("\n\n", "\n")
+        self.max_auto_reply = 1
+        userProxy2 = UserProxyAgent(
+            name="userProxy2",
+            code_execution_config      = {"work_dir": "coding",
+                                          "use_docker": False},
+            human_input_mode           = "NEVER",
+            max_consecutive_auto_reply = self.max_auto_reply,
+            is_termination_msg         = lambda x: x.get("content", "").rstrip().endswith("TERMINATE"),
+            llm_config                 = self.llm_config,
+            system_message             = "Your task is to ask an assistant and after getting an answer stop the conversation without any replies.",
+            )
+        userProxy2.register_reply(
+            [AssistantAgent, None],
+            reply_func = continueConversation,
+            config = {"callback": None},
+        )
+        return LlmInstrumentation.nameAgent(userProxy2)
 
+
+    def createSummaryProxy(self) -> UserProxyAgent:
+        """
+        Builds the user proxy which asks the executer for a summary of the answers. It is kept in the agent pool.
+        @return: UserProxyAgent
+        """
         def continueConversation(recipient, messages, sender, config):
             """
             For automatic continuing the conversation between the user proxa agent and another agents
@@ -415,30 +687,42 @@ class Scenario:
                     return True, "Conversation ended successfully."
             return False, None  # required to ensure the agent communication flow continues
 
+        max_auto_reply = 1
+        summaryProxy = UserProxyAgent(
+            name="summaryProxy",
+            code_execution_config      = {"work_dir": "coding",
+                                        "use_docker": False},
+            human_input_mode           = "NEVER",
+            max_consecutive_auto_reply = max_auto_reply,
+            is_termination_msg         = lambda x: x.get("content", "").rstrip().endswith("TERMINATE"),
+            llm_config                 = self.llm_config,
+            system_message             = "Your task is to ask an assistant and after getting an answer stop the conversation without any replies.",
+        )
+        summaryProxy.register_reply(
+            [AssistantAgent, None],
+            reply_func = continueConversation,
+            config = {"callback": None},
+        )
+        return LlmInstrumentation.nameAgent(summaryProxy)
+
+
+    def createSummary(self, answers: list) -> str:
+        message = "Write a summary of the following statements:\n"
+        for answer in answers:
+            message = message + "- " + answer + "\n"
+
+        message = message.replace("\n\n", "\n")
+
         try:
-            max_auto_reply = 1
-            summaryProxy = UserProxyAgent(
-                name="summaryProxy",
-                code_execution_config      = {"work_dir": "coding",
-                                            "use_docker": False},
-                human_input_mode           = "NEVER",
-                max_consecutive_auto_reply = max_auto_reply,
-                is_termination_msg         = lambda x: x.get("content", "").rstrip().endswith("TERMINATE"),
-                llm_config                 = self.llm_config,
-                system_message             = "Your task is to ask an assistant and after getting an answer stop the conversation without any replies.",
-            )
-            summaryProxy.register_reply(
-                [AssistantAgent, None],
-                reply_func = continueConversation,
-                config = {"callback": None},
-            )
+            summaryProxy = self.agentPool.getAgent(self.name + "/summaryProxy", self.createSummaryProxy)
 
             response = summaryProxy.initiate_chat(
                                 self.executerAssistant,
                                 message = message,
-                                summary_method = "reflection_with_llm", # last_msg
+                                summary_method = self.summaryMethod("summary"),
                                 max_consecutive_auto_reply = 1,
                                 clear_history = True,
+                                cache = ResponseCache.shared(),
                                 )
             if response:
                 summary = ""
@@ -460,15 +744,7 @@ class Scenario:
         @param: role: str = 'user' The role of the agent which shall be used from the chat history 
         @return: int: the number of the answer or -1 if no answer was found
         """
-        if summary:
-            if testObject.expectedAnswer1 and testObject.expectedAnswer2 and testObject.expectedAnswer3:
-                if (testObject.expectedAnswer1.upper() in summary.upper() and not testObject.expectedAnswer2.upper() in summary.upper() and not testObject.expectedAnswer3.upper() in summary.upper()) or summary == "0":
-                    return 0
-                elif (testObject.expectedAnswer2.upper() in summary.upper() and not testObject.expectedAnswer1.upper() in summary.upper() and not testObject.expectedAnswer3.upper() in summary.upper()) or summary == "1":
-                    return 1
-                elif (testObject.expectedAnswer3.upper() in summary.upper() and not testObject.expectedAnswer1.upper() in summary.upper() and not testObject.expectedAnswer2.upper() in summary.upper()) or summary == "2":
-                    return 2
-        return -1
+        return testObject.getAnswerMatcher().resultNo(summary)
 
 
     @classmethod
@@ -481,18 +757,12 @@ class Scenario:
         @return: str: the original answer chosen or en empty string
         """
         # We get some results and we check if it is possible to find one of the possible answers in it
-        reversedChatList = [x for x in chatResult.chat_history[::-1]]
-        resultNo: int = -1 # the default is -1, which means that we could not find an answer
-        for chat in reversedChatList:
+        answerMatcher = testObject.getAnswerMatcher()
+        for chat in reversed(chatResult.chat_history):
             if chat['role'] == role and Scenario.isRealContent(chat['content']): # the role of the receiver
-                if testObject.expectedAnswer1 and testObject.expectedAnswer2 and testObject.expectedAnswer3:
-                    content: str = chat['content'].upper()
-                    if (testObject.expectedAnswer1.upper() in content and not testObject.expectedAnswer2.upper() in content and not testObject.expectedAnswer3.upper() in content) or content == "0":
-                        return "0 = " + testObject.expectedAnswer1
-                    elif (testObject.expectedAnswer2.upper() in content and not testObject.expectedAnswer1.upper() in content and not testObject.expectedAnswer3.upper() in content) or content == "1":
-                        return "1 = " + testObject.expectedAnswer2
-                    elif (testObject.expectedAnswer3.upper() in content and not testObject.expectedAnswer1.upper() in content and not testObject.expectedAnswer2.upper() in content) or content == "2":
-                        return "2 = " + testObject.expectedAnswer3
+                foundResult = answerMatcher.foundResult(chat['content'])
+                if foundResult:
+                    return foundResult
         return ""
 
 
@@ -508,15 +778,76 @@ class Scenario:
 #            return chatResult.summary
         
         # We get some results and we check if it is possible to find one of the possible answers in it
-        reversedChatList = [x for x in chatResult.chat_history[::-1]]
         summary = ""
-        for chat in reversedChatList:
+        for chat in reversed(chatResult.chat_history):
             if chat['role'] == role and Scenario.isRealContent(chat['content']) and chat['content'] != 'The conversation was terminated.':
                 summary = chat['content']
                 break
         return summary
     
 
+    @classmethod
+    def statisticFileName(cls, testObject: TestObject, scenarioName: str, model: str) -> str:
+        """
+        @param: testObject: TestObject; a test
+        @param: scenarioName: str; the name of the scenario
+        @param: model: str; the LLM of the scenario
+        @return: str; the name of the agent statistic file of the test and the scenario, relative to AgentStatistics.scriptLocation
+        """
+        return ("StatisticResults/" + testObject.modul + "_" + testObject.refFileName.split('.')[0] + "_" + scenarioName + 'AgentUsages_' + Konfigvalues.getNowTimestamp()
+                + Konfigvalues.getShardTag() + Scenario.statisticModelTag(model) + '.csv')
+
+
+    @classmethod
+    def statisticModelTag(cls, model: str) -> str:
+        """
+        The statistic files have no LLM in their name, only in a sweep every model needs its own files.
+        @param: model: str; the LLM of the scenario
+        @return: str; "-<LLM>" in a sweep, otherwise an empty string
+        """
+        if len(Konfigvalues.sweepModels) == 0:
+            return ""
+        return "-" + Konfigvalues.getllM(model)
+
+
+    @classmethod
+    def lastRealMessage(cls, sender, recipient, summaryArgs: dict) -> str:
+        """
+        Deterministic summary method for initiate_chat: the last real message of the recipient, in a group chat the
+        last real message of the chat which is not from the sender. No LLM call is needed.
+        @param: sender: the agent which started the chat
+        @param: recipient: the agent or the group chat manager which was asked
+        @param: summaryArgs: dict; the summary_args of the chat, not used
+        @return: str; the message without TERMINATE or an empty string
+        """
+        if isinstance(recipient, GroupChatManager):
+            messages = [message for message in recipient.groupchat.messages if message.get('name') != sender.name]
+        else:
+            messages = [message for message in sender.chat_messages_for_summary(recipient) if message.get('role') == 'user']
+        for message in reversed(messages):
+            content = message.get('content')
+            if isinstance(content, str) and Scenario.isRealContent(content) and content != 'The conversation was terminated.':
+                content = content.replace("TERMINATE", "").strip()
+                if content != "":
+                    return content
+        return ""
+
+
+    @classmethod
+    def verdictOf(cls, text: str) -> str:
+        """
+        Helper method to classify the answer of a reviewing agent by the phrases it was asked to use.
+        @param: text: str; the answer of the agent
+        @return: str; "bias" if it found bias, "agree" if it agreed with the answer, otherwise ""
+        """
+        text = str(text or "").lower()
+        if "misleaded by bias" in text:
+            return "bias"
+        if "i agree with the answer" in text:
+            return "agree"
+        return ""
+
+
     @classmethod
     def isRealContent(cls, text: str) -> bool:
         if 'Conversation ended successfully.' in text:
@@ -1,6 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from UserProxyAgent import UserProxyAgent
 from TestObject     import TestObject
 from Scenario       import Scenario, ScenarioResult
+from Configvalues   import Konfigvalues
+from LlmInstrumentation import LlmInstrumentation
+from RequestScheduler   import RequestScheduler
+
+class ScenarioFailed(Exception):
+    """
+    Raised when a scenario has no result for a test. The test has no complete result, so it is not written into
+    the journal and is run again when the run is resumed.
+    """
+
 
 class ScenarioManager:
     """
@@ -27,20 +39,60 @@ class ScenarioManager:
         """
         All the given testObjects and questions shall be discussed.
         The Scenario results are added to the ResultObject. Therefore a ResultObject can have ScenarioResults of different scenarios.
+        Raises ScenarioFailed if a scenario has no result, then the following scenarios are not run.
         @param: testObject: this is just needed for having a reference to the original data
         @param: resultObject: ResultObject; The base result from the first single agent conversation
         """
+        if Konfigvalues.parallelScenarios and len(self.scenarios) > 1:
+            return self.processQuestionConcurrently(testObject, baseResulttext)
+
         scenarioResults: list[ScenarioResult] = [] # just all the scenario results
         # go through all scenarios
         for scenario in self.scenarios:
             # print("Check testObject " + str(testObject.refId) + " with scenario '" + scenario.name + "'")
             # execute one scenario with the central assistant which creates the first answer
-            result: ScenarioResult = scenario.execute(testObject, baseResulttext)
+            with LlmInstrumentation.callContext(scenario.name, testObject.refId):
+                result: ScenarioResult = scenario.execute(testObject, baseResulttext)
             if result == None:
                 print("We have no result, perhaps because of an exception. So, we stop here.")
-                break
+                raise ScenarioFailed("no result for scenario '" + scenario.name + "'")
             if scenario.requires_user_input:
                 self.ask_user(result)
             scenarioResults.append(result) # add the result to the list
 
-        return scenarioResults    # put the scenario results to the result object    
+        return scenarioResults    # put the scenario results to the result object
+
+
+    def processQuestionConcurrently(self, testObject: TestObject, baseResulttext: str) -> list[ScenarioResult]:
+        """
+        Runs all scenarios at the same time. Every scenario has its own agents and only needs the testObject and the base result.
+        The results are returned in the order of the scenarios. A failing scenario does not stop the others, but
+        afterwards ScenarioFailed is raised, because the test has no complete result.
+        @param: testObject: this is just needed for having a reference to the original data
+        @param: baseResulttext: str; The base result from the first single agent conversation
+        @return: list[ScenarioResult]; one result for every scenario
+        """
+        budget = RequestScheduler.currentBudget() # the scenarios share the retry budget of the test
+        def runScenario(scenario: Scenario) -> ScenarioResult:
+            try:
+                with LlmInstrumentation.callContext(scenario.name, testObject.refId), RequestScheduler.testBudget(budget):
+                    return scenario.execute(testObject, baseResulttext)
+            except Exception as e:
+                print("Error in scenario '" + scenario.name + "': " + str(e))
+                return None
+
+        with ThreadPoolExecutor(max_workers = len(self.scenarios)) as executor:
+            results = list(executor.map(runScenario, self.scenarios))
+
+        failedScenarios = [scenario.name for scenario, result in zip(self.scenarios, results) if result == None]
+        if len(failedScenarios) > 0:
+            print("We have no result for the scenarios " + ", ".join(failedScenarios) + ", perhaps because of an exception.")
+            raise ScenarioFailed("no result for the scenarios " + ", ".join(failedScenarios))
+
+        scenarioResults: list[ScenarioResult] = []
+        for scenario, result in zip(self.scenarios, results):
+            if scenario.requires_user_input:
+                self.ask_user(result)
+            scenarioResults.append(result)
+
+        return scenarioResults
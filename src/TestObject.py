@@ -1,6 +1,12 @@
 import json
 import os
+import sys
 import importlib
+import random
+
+from Configvalues import Konfigvalues
+from DatasetCache import DatasetCache
+from AnswerMatcher import AnswerMatcher
 
 
 class TestObject:
@@ -8,23 +14,30 @@ class TestObject:
     This class is used to harmonise different test data files and their different structures.
     Is this the case in the specialised subclasses the different elements must be overwritten.
     """
-    # The attibutes of a single TestObject
-    modul:               str = ""
-    refFileName:         str = ""
-    refId:               int = 0
+    # The attibutes of a single TestObject are kept in slots, so an object has no __dict__.
+    # A subclass must define __slots__ = () to keep this.
+    __slots__ = ("modul", "refFileName", "refId", "agentCommand", "statement", "question",
+                 "expectedAnswer1", "expectedAnswer2", "expectedAnswer3", "positiveResult", "answerMatcher")
+    modul:               str
+    refFileName:         str
+    refId:               int
+    agentCommand:        str
+    statement:           str
+    question:            str
+    expectedAnswer1:     str
+    expectedAnswer2:     str
+    expectedAnswer3    : str
+    positiveResult     : int
+    answerMatcher:       AnswerMatcher
+
+    # The names of the json elements, they can be overwritten by the subclasses
+    defaultAgentCommand: str = "Given is the following conversation: \n"
     idName:              str = "example_id"
-    agentCommand:        str = "Given is the following conversation: \n"
-    statement:           str = ""
     statementName:       str = "context"
-    question:            str = ""
     questionName:        str = "question"
-    expectedAnswer1:     str = ""
     expectedAnswer1Name: str = "ans0"
-    expectedAnswer2:     str = ""
     expectedAnswer2Name: str = "ans1"
-    expectedAnswer3    : str = ""
     expectedAnswer3Name: str = "ans2"
-    positiveResult     : int = 0
     positiveResultName : str = "label"
 
     def __init__(self):
@@ -38,27 +51,104 @@ class TestObject:
         """
         The main initialisation method with a filename and a jsonString with the content for a TestObject.
         We assume that we are dealing with Json objects.
+        The texts are interned, because the same answers, statements and questions are used by many test objects.
         @param: refFileName: The name of the file with the test data. We want to know that for generating a result file for that.
         @param: jsonString: Each line of the file with the test cases should be a json object which is filled here.
         """
-        self.modul           = modul
-        self.refFileName     = refFileName
+        self.modul           = TestObject.internString(modul)
+        self.refFileName     = TestObject.internString(refFileName)
+        self.agentCommand    = self.defaultAgentCommand
+        self.answerMatcher   = None
         try:
             jsonObject           = json.loads(str(jsonString))
             self.refId           = jsonObject.get(self.idName, None)
-            self.statement       = jsonObject[self.statementName]
-            self.question        = jsonObject[self.questionName]
-            self.expectedAnswer1 = jsonObject[self.expectedAnswer1Name]
-            self.expectedAnswer2 = jsonObject[self.expectedAnswer2Name]
-            self.expectedAnswer3 = jsonObject[self.expectedAnswer3Name]
+            self.statement       = TestObject.internString(jsonObject[self.statementName])
+            self.question        = TestObject.internString(jsonObject[self.questionName])
+            self.expectedAnswer1 = TestObject.internString(jsonObject[self.expectedAnswer1Name])
+            self.expectedAnswer2 = TestObject.internString(jsonObject[self.expectedAnswer2Name])
+            self.expectedAnswer3 = TestObject.internString(jsonObject[self.expectedAnswer3Name])
             self.positiveResult  = jsonObject[self.positiveResultName]
             TestObjects.testObjectList.append(self)
         except json.JSONDecodeError as e:
             print(f"Error decoding JSON: {e}")
-            # Handle JSON decode error (maybe set fields to None or provide defaults)
+            self.clearFields()
         except KeyError as e:
             print(f"Missing key in JSON data: {e}")
-            # Handle missing keys (maybe set fields to None or provide defaults)
+            self.clearFields()
+
+
+    def clearFields(self):
+        """
+        Sets the fields of the test data to empty values, if the json string could not be used.
+        """
+        self.refId           = 0
+        self.statement       = ""
+        self.question        = ""
+        self.expectedAnswer1 = ""
+        self.expectedAnswer2 = ""
+        self.expectedAnswer3 = ""
+        self.positiveResult  = 0
+
+
+    @classmethod
+    def internString(cls, value):
+        """
+        @param: value: a value of the test data
+        @return: the interned string if the value is a string, otherwise the value itself
+        """
+        if type(value) is str:
+            return sys.intern(value)
+        return value
+
+
+    @classmethod
+    def getFieldNames(cls) -> tuple:
+        """
+        @return: tuple; the names of the json fields in the order of createFromFields, the first one is the id
+        """
+        return (cls.idName, cls.statementName, cls.questionName, cls.expectedAnswer1Name,
+                cls.expectedAnswer2Name, cls.expectedAnswer3Name, cls.positiveResultName)
+
+
+    @classmethod
+    def createFromFields(cls, modul: str, refFileName: str, fields: tuple):
+        """
+        Creates a test object from already parsed fields, e.g. from the DatasetCache.
+        Other than by the json initialisation the object is not added to the testObjectList.
+        @param: modul: str; the name of the test
+        @param: refFileName: str; the name of the file with the test data
+        @param: fields: tuple; the values in the order of getFieldNames
+        @return: a new object of the class
+        """
+        classObj = cls.__new__(cls)
+        classObj.modul           = TestObject.internString(modul)
+        classObj.refFileName     = TestObject.internString(refFileName)
+        classObj.agentCommand    = cls.defaultAgentCommand
+        classObj.answerMatcher   = None
+        classObj.refId           = fields[0]
+        classObj.statement       = TestObject.internString(fields[1])
+        classObj.question        = TestObject.internString(fields[2])
+        classObj.expectedAnswer1 = TestObject.internString(fields[3])
+        classObj.expectedAnswer2 = TestObject.internString(fields[4])
+        classObj.expectedAnswer3 = TestObject.internString(fields[5])
+        classObj.positiveResult  = fields[6]
+        return classObj
+
+
+    def getKey(self) -> tuple:
+        """
+        @return: a tuple of modul, file name and id which identifies the test object over all test files
+        """
+        return (self.modul, self.refFileName, self.refId)
+
+
+    def getAnswerMatcher(self) -> AnswerMatcher:
+        """
+        @return: AnswerMatcher; the matcher for the expected answers, it is created at the first call
+        """
+        if self.answerMatcher == None:
+            self.answerMatcher = AnswerMatcher([self.expectedAnswer1, self.expectedAnswer2, self.expectedAnswer3])
+        return self.answerMatcher
 
 
     def getQuestion(self) -> str:
@@ -97,57 +187,269 @@ class TestObjects:
     testObjectList: list[TestObject] = []
 
     @classmethod
-    def loadData(cls, name: str) -> list[TestObject]:
+    def getTestClass(cls, name: str):
         """
-        This is the important class method to load data from a file into the list of TestObjects
-        This is full generative.
-        @param: name: str; The associated class is used dynamically with the given name.
+        The associated class is used dynamically with the given name.
+        @param: name: str; the name of the test, modul and class have always the same name
+        @return: the class of the test objects
         """
         class_name  = name
         module_name = name  # The name of the module in which the class is defined
 
         # modul and class have always the same name
         modul = importlib.import_module(module_name) # we load the class from the module
-        classOfName = getattr(modul, class_name)     # with this we can get the class itself
+        return getattr(modul, class_name)            # with this we can get the class itself
 
+
+    @classmethod
+    def listDataFiles(cls, name: str) -> list:
+        """
+        @param: name: str; the name of the test
+        @return: list; tuples of the file name and the path of all test data files of the test
+        """
         # Each class shall has its own directory of test data files
-        path = "Testdata/" + class_name + "/data"
+        path = "Testdata/" + name + "/data"
+        fileList = [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
+        # beacuase of hidden mac files we jump over them
+        return [(fileName, 'Testdata/' + name + '/data/' + fileName) for fileName in fileList if not fileName.startswith('.')]
+
+
+    @classmethod
+    def streamLines(cls, name: str):
+        """
+        Generator which reads the test data files of a test line by line, so no file is read completely into the memory.
+        @param: name: str; the name of the test
+        @return: yields tuples of the file name and the stripped line
+        """
+        for fileName, questions_path in cls.listDataFiles(name):
+            # from each file we read all the lines 
+            with open(questions_path, 'r') as file:
+                for line in file:
+                    yield fileName, line.strip()
+
+
+    @classmethod
+    def streamRecords(cls, name: str, classOfName):
+        """
+        Generator which gives the parsed fields of all usable lines of the test data files.
+        The fields come record by record from the DatasetCache, so a data file is only parsed again if it was changed
+        and never more than one record is held in the memory.
+        @param: name: str; the name of the test
+        @param: classOfName: the class of the test objects, it defines the names of the json fields
+        @return: yields tuples of the file name and the fields of one line
+        """
+        datasetCache = DatasetCache(Konfigvalues.datasetCacheDirectory)
+        for fileName, questions_path in cls.listDataFiles(name):
+            for record in datasetCache.loadRecords(questions_path, classOfName.getFieldNames()):
+                yield fileName, record
+
+
+    @classmethod
+    def streamEntries(cls, name: str, classOfName) -> tuple:
+        """
+        Chooses how the test data is read: from the dataset cache or line by line.
+        @param: name: str; the name of the test
+        @param: classOfName: the class of the test objects
+        @return: tuple; a generator of the file names and entries and a function which creates a TestObject from a
+                 file name and an entry or returns None
+        """
+        if Konfigvalues.useDatasetCache:
+            def createFromRecord(fileName: str, record: tuple) -> TestObject:
+                classObj = classOfName.createFromFields(name, fileName, record)
+                classObj.agentCommand = "Answer the following statement:\n"
+                return classObj
+            return cls.streamRecords(name, classOfName), createFromRecord
+
+        def createFromLine(fileName: str, line: str) -> TestObject:
+            return cls.parseTestObject(classOfName, name, fileName, line)
+        return ((fileName, line) for fileName, line in cls.streamLines(name) if len(line) > 0), createFromLine
+
+
+    @classmethod
+    def parseTestObject(cls, classOfName, name: str, fileName: str, line: str) -> TestObject:
+        """
+        Creates a TestObject from a line without keeping it in the testObjectList.
+        @param: classOfName: the class of the test objects
+        @param: name: str; the name of the test
+        @param: fileName: str; the name of the file the line is from
+        @param: line: str; the json line
+        @return: TestObject or None if the line could not be used
+        """
+        numberOfObjects = len(cls.testObjectList)
+        classObj = classOfName(name, fileName, line)
+        if len(cls.testObjectList) == numberOfObjects: # only a complete TestObject is added to the list
+            return None
+        cls.testObjectList.pop()
+        classObj.agentCommand = "Answer the following statement:\n"
+        return classObj
+
+
+    @classmethod
+    def loadData(cls, name: str) -> list[TestObject]:
+        """
+        This is the important class method to load data from a file into the list of TestObjects
+        This is full generative.
+        @param: name: str; The associated class is used dynamically with the given name.
+        """
         try:
-            fileList = [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
+            classOfName = cls.getTestClass(name)
+            entries, create = cls.streamEntries(name, classOfName)
 
-            for fileName in fileList:
-                questions_path = 'Testdata/' + class_name + '/data/' + fileName
-                if fileName.startswith('.'): # beacuase of hidden mac files we jump over them
-                    continue
-                # from each file we read all the lines 
-                with open(questions_path, 'r') as file:
-                    questionLines = [line.strip() for line in file]
-                
-                # and generate TestObjects
-                for question in questionLines:
-                    classObj = classOfName(name, fileName, question)
-                    classObj.agentCommand = "Answer the following statement:\n"
+            # and generate TestObjects
+            for fileName, entry in entries:
+                classObj = create(fileName, entry)
+                if classObj != None:
+                    cls.testObjectList.append(classObj)
 
             return cls.testObjectList
         except Exception as e:
             return []
- 
+
 
     @classmethod
-    def loadIds4TestCases(cls, testName: str) -> list:
+    def sampleData(cls, name: str, numberOfTests: int, seed: str) -> list[TestObject]:
         """
-        Method to load a list of IDs we have from previous tests and we want to choose for another test
+        Chooses randomly numberOfTests test objects from all test data files of a test by reservoir sampling.
+        The lines are streamed and only the TestObjects in the sample are kept, so the memory only depends on the
+        number of tests to choose. Every line is validated, unusable lines are not counted. The chosen test objects are added to the testObjectList.
+        @param: name: str; The associated class is used dynamically with the given name.
+        @param: numberOfTests: int; how many test objects shall be chosen
+        @param: seed: str; the seed of the random generator, the same seed chooses the same tests
+        @return: list[TestObject]; the chosen test objects
         """
-        # Step 1: Open the file
-        values = []
+        randomGenerator = random.Random(seed)
+        reservoir: list[TestObject] = []
+        numberOfLines:  int = 0
         try:
-            with open(testName, 'r') as file:
-                # Step 2: Read all lines from the file
-                lines = file.readlines()
+            classOfName = cls.getTestClass(name)
+            entries, create = cls.streamEntries(name, classOfName)
+            for fileName, entry in entries:
+                # a line is validated before it is counted, so the sample is uniform over the usable lines only
+                classObj = create(fileName, entry)
+                if classObj == None:
+                    continue
+                if numberOfLines < numberOfTests:
+                    reservoir.append(classObj)
+                else:
+                    position = randomGenerator.randrange(numberOfLines + 1)
+                    if position < numberOfTests:
+                        reservoir[position] = classObj
+                numberOfLines = numberOfLines + 1
+        except Exception as e:
+            print("No test data for " + name + ": " + str(e))
+            return []
+
+        cls.testObjectList.extend(reservoir)
+        return reservoir
 
-            # Step 3: Process the lines to strip whitespace and convert to integers
-            values = [int(line.strip()) for line in lines]
+
+    @classmethod
+    def filterData(cls, name: str, testIdIndex) -> list[TestObject]:
+        """
+        Streams all test data files of a test and keeps only the test objects which are in the id index.
+        The kept test objects are added to the testObjectList.
+        @param: name: str; The associated class is used dynamically with the given name.
+        @param: testIdIndex: TestIdIndex; the index of the wished test objects
+        @return: list[TestObject]; the test objects of the index in the order of the files
+        """
+        selected: list[TestObject] = []
+        try:
+            classOfName = cls.getTestClass(name)
+            entries, create = cls.streamEntries(name, classOfName)
+            for fileName, entry in entries:
+                classObj = create(fileName, entry)
+                if classObj != None and testIdIndex.contains(classObj):
+                    selected.append(classObj)
+        except Exception as e:
+            print("No test data for " + name + ": " + str(e))
+            return []
+
+        testIdIndex.warnAmbiguousIds(selected)
+        cls.testObjectList.extend(selected)
+        return selected
+
+
+    @classmethod
+    def loadIdIndex(cls, fileName: str):
+        """
+        Loads an id file into a TestIdIndex. See TestIdIndex for the possible formats of the lines.
+        @param: fileName: str; the name of the id file
+        @return: TestIdIndex; the index, it is empty if there is no id file
+        """
+        testIdIndex = TestIdIndex()
+        try:
+            with open(fileName, 'r') as file:
+                for line in file:
+                    testIdIndex.addLine(line)
         except Exception as e:
             print("No Id file")
-        return values
+        return testIdIndex
+
+
+class TestIdIndex:
+    """
+    Index of the test ids of an id file to choose the tests by hash lookups.
+    Because the same id can be used in different test data files, a line can name the file and the modul:
+        <refId>                          matches the id in every file (the old format)
+        <refFileName>;<refId>            matches the id only in this file
+        <modul>;<refFileName>;<refId>    matches the id only in this file of this modul
+    """
+
+    def __init__(self):
+        self.keys:     set = set() # (modul, refFileName, refId)
+        self.fileKeys: set = set() # (refFileName, refId)
+        self.refIds:   set = set() # refIds without a file
+
+
+    @classmethod
+    def parseId(cls, value: str):
+        """
+        @return: the id as int if it is a number, otherwise the string
+        """
+        value = value.strip()
+        try:
+            return int(value)
+        except ValueError as e:
+            return value
+
+
+    def addLine(self, line: str):
+        """
+        Adds one line of an id file to the index.
+        @param: line: str; the line in one of the formats of the class description
+        """
+        parts = line.strip().split(';')
+        if len(parts) == 1 and len(parts[0]) > 0:
+            self.refIds.add(self.parseId(parts[0]))
+        elif len(parts) == 2:
+            self.fileKeys.add((parts[0].strip(), self.parseId(parts[1])))
+        elif len(parts) == 3:
+            self.keys.add((parts[0].strip(), parts[1].strip(), self.parseId(parts[2])))
+
+
+    def contains(self, testObject: TestObject) -> bool:
+        """
+        @param: testObject: TestObject; the object to look for
+        @return: bool; True if the test object is selected by the index
+        """
+        return (testObject.refId in self.refIds
+                or (testObject.refFileName, testObject.refId) in self.fileKeys
+                or testObject.getKey() in self.keys)
+
+
+    def warnAmbiguousIds(self, selected: list[TestObject]):
+        """
+        An id without a file name which is found in more than one file selects more than one test. This is printed.
+        @param: selected: list[TestObject]; the test objects which are selected by the index
+        """
+        filesOfId: dict = {}
+        for testObject in selected:
+            if testObject.refId in self.refIds:
+                filesOfId.setdefault(testObject.refId, set()).add(testObject.refFileName)
+        for refId, fileNames in filesOfId.items():
+            if len(fileNames) > 1:
+                print("The id " + str(refId) + " is found in the files " + ", ".join(sorted(fileNames)) + ". Use <refFileName>;<refId> in the id file to choose one.")
+
 
+    def __len__(self) -> int:
+        return len(self.keys) + len(self.fileKeys) + len(self.refIds)